@@ -0,0 +1,154 @@
+import argparse
+import json
+import logging
+import os
+from dataclasses import asdict
+from json import dumps
+from random import uniform
+from itertools import islice
+from timeit import timeit
+
+from async_bus_map_tracker.core.broadcast import build_snapshot_message, BusesFragments, ViewportCache
+from async_bus_map_tracker.core.models import Bus, MessageTypes, WindowBounds
+from async_bus_map_tracker.core.routes import load_routes
+from async_bus_map_tracker.core.storage import BusesStorage
+from async_bus_map_tracker.core.validators import JsonMessageValidator
+
+logger = logging.getLogger()
+logging.basicConfig(level=logging.INFO, format='%(message)s')
+
+MOSCOW_BOUNDS = WindowBounds(south_lat=55.55, north_lat=55.95, west_lng=37.30, east_lng=37.90)
+VIEWPORT_BOUNDS = WindowBounds(south_lat=55.726, north_lat=55.774, west_lng=37.544, east_lng=37.656)
+
+
+def generate_buses(buses_amount: int, bounds: WindowBounds = MOSCOW_BOUNDS) -> list[Bus]:
+    return [
+        Bus(
+            busId=f'bench-{bus_index}',
+            lat=uniform(bounds.south_lat, bounds.north_lat),
+            lng=uniform(bounds.west_lng, bounds.east_lng),
+            route='bench',
+        )
+        for bus_index in range(buses_amount)
+    ]
+
+
+def benchmark_spatial(buses_amounts: list[int], repeat: int) -> None:
+    """Compare bounds lookups of the grid index with a full scan of all buses."""
+    logger.info(f'{"buses":>10} {"full scan, ms":>15} {"grid index, ms":>15} {"update, us":>12}')
+    for buses_amount in buses_amounts:
+        buses = generate_buses(buses_amount)
+        registered_buses = BusesStorage()
+        for bus in buses:
+            registered_buses.update(bus)
+
+        full_scan_time = timeit(
+            lambda: [bus for bus in buses if VIEWPORT_BOUNDS.is_inside(bus.lat, bus.lng)],
+            number=repeat,
+        )
+        grid_time = timeit(lambda: registered_buses.find_inside(VIEWPORT_BOUNDS), number=repeat)
+        moved_buses = generate_buses(min(buses_amount, 10000))
+        update_time = timeit(lambda: [registered_buses.update(bus) for bus in moved_buses], number=1)
+        logger.info(
+            f'{buses_amount:>10} {full_scan_time / repeat * 1000:>15.3f} '
+            f'{grid_time / repeat * 1000:>15.3f} {update_time / len(moved_buses) * 1e6:>12.2f}',
+        )
+
+
+def benchmark_encoding(buses_amounts: list[int], repeat: int) -> None:
+    """Compare per-browser encoding of one tick with shared bus fragments and shared viewports for 100 viewers."""
+    viewers_amount = 100
+    logger.info(f'{"buses":>10} {"per browser, ms":>16} {"fragments, ms":>15} {"viewports, ms":>15}')
+    for buses_amount in buses_amounts:
+        buses = generate_buses(buses_amount)
+
+        def encode_per_browser() -> None:
+            for _ in range(viewers_amount):
+                dumps({'msgType': 'Buses', 'buses': [asdict(bus) for bus in buses]})
+
+        def encode_fragments() -> None:
+            registered_buses = BusesStorage()
+            for _ in range(viewers_amount):
+                build_snapshot_message(buses, registered_buses.fragments)
+
+        registered_buses = BusesStorage()
+        for bus in buses:
+            registered_buses.update(bus)
+
+        def encode_viewports() -> None:
+            registered_buses.fragments, registered_buses.viewports = BusesFragments(), ViewportCache()
+            for _ in range(viewers_amount):
+                registered_buses.find_viewport(MOSCOW_BOUNDS, now=0).get_snapshot(registered_buses.fragments)
+
+        per_browser_time = timeit(encode_per_browser, number=repeat)
+        fragments_time = timeit(encode_fragments, number=repeat)
+        viewports_time = timeit(encode_viewports, number=repeat)
+        logger.info(
+            f'{buses_amount:>10} {per_browser_time / repeat * 1000:>16.3f} {fragments_time / repeat * 1000:>15.3f} '
+            f'{viewports_time / repeat * 1000:>15.3f}',
+        )
+
+
+def benchmark_routes(routes_amounts: list[int], repeat: int) -> None:
+    """Compare emulator start with parsing all route JSON files against the binary routes cache."""
+    directory_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'routes')
+    list(load_routes(directory_path))
+
+    def load_json_routes() -> list[dict]:
+        routes = []
+        for filename in os.listdir(directory_path):
+            if filename.endswith('.json'):
+                with open(os.path.join(directory_path, filename), 'r', encoding='utf8') as file:
+                    routes.append(json.load(file))
+        return routes
+
+    json_time = timeit(load_json_routes, number=repeat)
+    logger.info(f'{"routes":>10} {"all JSON, ms":>13} {"cache, ms":>10}')
+    for routes_amount in routes_amounts:
+        cache_time = timeit(lambda: list(islice(load_routes(directory_path), routes_amount)), number=repeat)
+        logger.info(f'{routes_amount:>10} {json_time / repeat * 1000:>13.2f} {cache_time / repeat * 1000:>10.2f}')
+
+
+def benchmark_validation(batch_sizes: list[int], repeat: int) -> None:
+    """Compare stdlib JSON parsing with a set rebuilt per message against the schema validator."""
+    messages_amount = 1000
+
+    def validate_stdlib(message: str) -> dict:
+        json_message = json.loads(message)
+        assert json_message['msgType'] in set(item.value for item in MessageTypes)
+        return json_message
+
+    logger.info(f'{"batch":>10} {"stdlib, msgs/s":>15} {"validator, msgs/s":>18}')
+    for batch_size in batch_sizes:
+        messages = [
+            dumps({'msgType': 'Buses', 'buses': [asdict(bus) for bus in generate_buses(batch_size)]})
+            for _ in range(messages_amount)
+        ]
+        stdlib_time = timeit(lambda: [validate_stdlib(message) for message in messages], number=repeat)
+        validator_time = timeit(
+            lambda: [JsonMessageValidator(message=message).get_validated_data() for message in messages],
+            number=repeat,
+        )
+        total_messages = messages_amount * repeat
+        logger.info(f'{batch_size:>10} {total_messages / stdlib_time:>15.0f} {total_messages / validator_time:>18.0f}')
+
+
+BENCHMARKS = {
+    'spatial': benchmark_spatial,
+    'encoding': benchmark_encoding,
+    'routes': benchmark_routes,
+    'validation': benchmark_validation,
+}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument('benchmark', choices=BENCHMARKS.keys(), help='benchmark name')
+    parser.add_argument('-n', '--buses', nargs='+', type=int, default=[1000, 10000, 100000], help='buses amounts')
+    parser.add_argument('-r', '--repeat', type=int, default=100, help='repeats per measurement')
+    args = parser.parse_args()
+    BENCHMARKS[args.benchmark](args.buses, args.repeat)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,225 @@
+import struct
+import sys
+from array import array
+from collections.abc import Callable
+from dataclasses import asdict, dataclass, field
+from json import dumps
+from math import ceil, floor
+
+from async_bus_map_tracker.core import consts
+from async_bus_map_tracker.core.models import BinaryMessageTypes, BrowserSession, Bus, MessageTypes, WindowBounds
+
+BINARY_HEADER = struct.Struct('<B3xI')
+
+ViewportKey = tuple[int, int, int, int]
+
+
+@dataclass(kw_only=True, slots=True)
+class BusesFragments:
+    """JSON fragments of buses shared by all browser connections.
+
+    Bus instances are immutable and replaced on every position update, so the cached instance is used
+    as the fragment version: each bus position is encoded once, however many browsers receive it.
+    """
+
+    fragments: dict[str, tuple[Bus, str]] = field(default_factory=dict)
+
+    def encode(self, bus: Bus) -> str:
+        cached = self.fragments.get(bus.busId)
+        if cached is not None and cached[0] is bus:
+            return cached[1]
+        fragment = dumps(asdict(bus))
+        self.fragments[bus.busId] = (bus, fragment)
+        return fragment
+
+    def encode_list(self, buses: list[Bus]) -> str:
+        return f'[{", ".join(map(self.encode, buses))}]'
+
+    def discard(self, bus_id: str) -> None:
+        self.fragments.pop(bus_id, None)
+
+
+@dataclass(kw_only=True, slots=True)
+class BusIndexes:
+    """Indexes of buses in binary messages shared by all browser connections.
+
+    Index of a removed bus is given to the next new bus, so dictionaries of browsers stay as large
+    as the number of buses registered at once.
+    """
+
+    indexes: dict[str, int] = field(default_factory=dict)
+    free_indexes: list[int] = field(default_factory=list)
+
+    def get(self, bus_id: str) -> int:
+        index = self.indexes.get(bus_id)
+        if index is None:
+            index = self.free_indexes.pop() if self.free_indexes else len(self.indexes)
+            self.indexes[bus_id] = index
+        return index
+
+    def discard(self, bus_id: str) -> None:
+        index = self.indexes.pop(bus_id, None)
+        if index is not None:
+            self.free_indexes.append(index)
+
+
+def build_snapshot_message(buses: list[Bus], fragments: BusesFragments) -> str:
+    return f'{{"msgType": "{MessageTypes.BUSES}", "buses": {fragments.encode_list(buses)}}}'
+
+
+def build_binary_buses_message(indexes: list[int], buses: list[Bus]) -> bytes:
+    indexes = array('I', indexes)
+    coordinates = array('f', [coordinate for bus in buses for coordinate in (bus.lat, bus.lng)])
+    if sys.byteorder == 'big':
+        indexes.byteswap()
+        coordinates.byteswap()
+    return BINARY_HEADER.pack(BinaryMessageTypes.BUSES.value, len(buses)) + indexes.tobytes() + coordinates.tobytes()
+
+
+@dataclass(kw_only=True, slots=True)
+class Viewport:
+    """Buses inside quantized window bounds, shared by all browsers looking at them during one tick."""
+
+    bounds: WindowBounds
+    buses: dict[str, Bus]
+    expires_at: float
+    snapshot: str | None = None
+    binary_dictionary: list[tuple[int, str, str]] = field(default_factory=list)
+    binary_snapshot: bytes | None = None
+
+    def get_snapshot(self, fragments: BusesFragments) -> str:
+        if self.snapshot is None:
+            self.snapshot = build_snapshot_message(list(self.buses.values()), fragments)
+        return self.snapshot
+
+    def get_binary_snapshot(self, bus_indexes: BusIndexes) -> tuple[list[tuple[int, str, str]], bytes]:
+        """Return dictionary entries [(index, busId, route), ...] of the buses and their binary message."""
+        if self.binary_snapshot is None:
+            buses = list(self.buses.values())
+            self.binary_dictionary = [(bus_indexes.get(bus.busId), bus.busId, bus.route) for bus in buses]
+            self.binary_snapshot = build_binary_buses_message(
+                [bus_index for bus_index, _, _ in self.binary_dictionary], buses,
+            )
+        return self.binary_dictionary, self.binary_snapshot
+
+
+@dataclass(kw_only=True, slots=True)
+class ViewportCache:
+    """Viewports of browsers grouped by window bounds rounded outwards to quantum degrees.
+
+    Browsers with the same or near-identical bounds get the same viewport, so buses inside it are looked up
+    and encoded once per tick instead of once per browser. Viewports live for ttl seconds.
+    """
+
+    ttl: float = consts.VIEWPORT_CACHE_TTL
+    quantum: float = consts.VIEWPORT_QUANTUM
+    viewports: dict[ViewportKey, Viewport] = field(default_factory=dict)
+    purged_at: float = 0
+
+    def get_key(self, bounds: WindowBounds) -> ViewportKey:
+        return (
+            floor(bounds.south_lat / self.quantum),
+            ceil(bounds.north_lat / self.quantum),
+            floor(bounds.west_lng / self.quantum),
+            ceil(bounds.east_lng / self.quantum),
+        )
+
+    def get(self, bounds: WindowBounds, find_inside: Callable[[WindowBounds], list[Bus]], now: float) -> Viewport:
+        """Return cached viewport for bounds or look up buses inside it with find_inside."""
+        if now >= self.purged_at + self.ttl:
+            self.purge(now)
+        key = self.get_key(bounds)
+        viewport = self.viewports.get(key)
+        if viewport is None or viewport.expires_at <= now:
+            south_lat, north_lat, west_lng, east_lng = (coordinate * self.quantum for coordinate in key)
+            viewport_bounds = WindowBounds(
+                south_lat=south_lat,
+                north_lat=north_lat,
+                west_lng=west_lng,
+                east_lng=east_lng,
+            )
+            viewport = Viewport(
+                bounds=viewport_bounds,
+                buses={bus.busId: bus for bus in find_inside(viewport_bounds)},
+                expires_at=now + self.ttl,
+            )
+            self.viewports[key] = viewport
+        return viewport
+
+    def purge(self, now: float) -> None:
+        self.viewports = {key: viewport for key, viewport in self.viewports.items() if viewport.expires_at > now}
+        self.purged_at = now
+
+
+def build_delta_message(added: list[Bus], moved: list[Bus], removed: list[str], fragments: BusesFragments) -> str:
+    return (
+        f'{{"msgType": "{MessageTypes.BUSES_DELTA}", "added": {fragments.encode_list(added)}, '
+        f'"moved": {fragments.encode_list(moved)}, "removed": {dumps(removed)}}}'
+    )
+
+
+def prepare_buses_message(session: BrowserSession, viewport: Viewport, fragments: BusesFragments) -> str | None:
+    """Build next message for browser and remember buses sent to it.
+
+    Browsers without delta mode and delta browsers after connect or bounds change receive a full snapshot
+    shared by the viewport, other delta browsers receive only added, moved and removed buses.
+
+    Returns:
+        message text or None when delta browser has nothing to update.
+    """
+    current_buses = viewport.buses
+    sent_buses, session.sent_buses = session.sent_buses, current_buses
+    if not session.is_delta or session.needs_snapshot:
+        session.needs_snapshot = False
+        return viewport.get_snapshot(fragments)
+
+    added, moved = [], []
+    for bus_id, bus in current_buses.items():
+        sent_bus = sent_buses.get(bus_id)
+        if sent_bus is None:
+            added.append(bus)
+        elif sent_bus.lat != bus.lat or sent_bus.lng != bus.lng:
+            moved.append(bus)
+    removed = [bus_id for bus_id in sent_buses if bus_id not in current_buses]
+    if not (added or moved or removed):
+        return None
+    return build_delta_message(added, moved, removed, fragments)
+
+
+def build_binary_messages(session: BrowserSession, viewport: Viewport, bus_indexes: BusIndexes) -> list[bytes]:
+    """Encode buses for the binary subprotocol.
+
+    Every message starts with the 8 bytes header: message type and items count. Ids and routes of buses
+    are sent in the dictionary message as JSON [[index, busId, route], ...] when the index is new to the browser,
+    then buses message carries only their indexes as uint32 followed by lat, lng pairs as float32,
+    all little-endian, so browser reads them with typed arrays without copying. Indexes are shared by all
+    browsers, so the buses message is built once per viewport.
+
+    Dictionary remembered for the browser is cleared once it is larger than BUS_DICTIONARY_MAX_SIZE
+    and twice the viewport, then the browser gets the whole dictionary of the viewport again.
+    """
+    dictionary, buses_message = viewport.get_binary_snapshot(bus_indexes)
+    if len(session.bus_dictionary) > max(consts.BUS_DICTIONARY_MAX_SIZE, 2 * len(dictionary)):
+        session.bus_dictionary.clear()
+    new_entries = [entry for entry in dictionary if session.bus_dictionary.get(entry[0]) != entry[1]]
+    if not new_entries:
+        return [buses_message]
+    for bus_index, bus_id, _ in new_entries:
+        session.bus_dictionary[bus_index] = bus_id
+    dictionary_message = (
+        BINARY_HEADER.pack(BinaryMessageTypes.BUSES_DICTIONARY.value, len(new_entries))
+        + dumps(new_entries, ensure_ascii=False).encode()
+    )
+    return [dictionary_message, buses_message]
+
+
+def prepare_buses_messages(
+    session: BrowserSession,
+    viewport: Viewport,
+    fragments: BusesFragments,
+    bus_indexes: BusIndexes,
+) -> list[str | bytes]:
+    if session.is_binary:
+        return build_binary_messages(session, viewport, bus_indexes)
+    message = prepare_buses_message(session, viewport, fragments)
+    return [message] if message is not None else []
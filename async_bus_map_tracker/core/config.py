@@ -3,7 +3,7 @@ import os
 
 from dotenv import load_dotenv
 
-from async_bus_map_tracker.core.models import ConfigData
+from async_bus_map_tracker.core.models import ConfigData, SimulatorEngines
 
 load_dotenv()
 
@@ -19,6 +19,16 @@ def configure_application(is_test: bool = False) -> ConfigData:
     parser.add_argument('-ws_n', '--websockets_number', help='set websockets number')
     parser.add_argument('-e_id', '--emulator_id', help='set emulator_id - prefix for busID')
     parser.add_argument('-rt', '--refresh_timeout', help='set refresh timeout for coordinates update')
+    parser.add_argument(
+        '-en',
+        '--engine',
+        choices=[engine.value for engine in SimulatorEngines],
+        help='set buses simulator engine: task per bus or one fleet task',
+    )
+    parser.add_argument('-pn', '--processes', help='set amount of emulator processes sharing the routes')
+    parser.add_argument('-wn', '--workers', help='set amount of server worker processes')
+    parser.add_argument('-td', '--tracks_dir', help='set directory to record bus tracks, not recorded if empty')
+    parser.add_argument('-mp', '--metrics_port', help='set HTTP port for metrics, not served if 0')
     parser.add_argument('-v', '--logging', help='set logging settings')
     parser_args = parser.parse_args() if not is_test else ConfigData()
     return ConfigData(
@@ -31,5 +41,10 @@ def configure_application(is_test: bool = False) -> ConfigData:
         websockets_number=int(parser_args.websockets_number or os.getenv('WEBSOCKETS_NUMBER', '')),
         emulator_id=parser_args.emulator_id or os.getenv('PREFIX_EMULATOR_ID', ''),
         refresh_timeout=int(parser_args.refresh_timeout or os.getenv('COORD_REFRESH_TIMEOUT', '')),
+        engine=parser_args.engine or os.getenv('SIMULATOR_ENGINE', SimulatorEngines.TASKS.value),
+        processes=int(parser_args.processes or os.getenv('EMULATOR_PROCESSES', '1')),
+        workers=int(parser_args.workers or os.getenv('SERVER_WORKERS', '1')),
+        tracks_dir=parser_args.tracks_dir or os.getenv('TRACKS_DIR', ''),
+        metrics_port=int(parser_args.metrics_port or os.getenv('METRICS_PORT', '0')),
         logging=parser_args.logging or os.getenv('LOGGING', ''),
     )
@@ -1,8 +1,9 @@
 import logging
 from functools import wraps
 
+import trio
 from trio import sleep
-from trio_websocket import ConnectionClosed, HandshakeError
+from trio_websocket import ConnectionClosed, HandshakeError, WebSocketServer
 
 from async_bus_map_tracker.core import consts
 
@@ -20,3 +21,20 @@ def relaunch_on_disconnect(async_function):
                 logger.error(f'Exception occurred exc={exc}. Reconnect in {consts.RECONNECT_TIMEOUT} seconds')
             await sleep(consts.RECONNECT_TIMEOUT)
     return wrapper
+
+
+async def serve_websocket_reuse_port(handler, host: str, port: int, ssl_context: None = None) -> None:
+    """Serve websocket like trio_websocket.serve_websocket with SO_REUSEPORT, so several processes share the port."""
+    if ssl_context is not None:
+        raise ValueError('SSL is not supported for reuse port listeners')
+    listeners = []
+    for family, socket_type, proto, _, address in await trio.socket.getaddrinfo(
+        host, port, type=trio.socket.SOCK_STREAM, flags=trio.socket.AI_PASSIVE,
+    ):
+        sock = trio.socket.socket(family, socket_type, proto)
+        sock.setsockopt(trio.socket.SOL_SOCKET, trio.socket.SO_REUSEADDR, 1)
+        sock.setsockopt(trio.socket.SOL_SOCKET, trio.socket.SO_REUSEPORT, 1)
+        await sock.bind(address)
+        sock.listen()
+        listeners.append(trio.SocketListener(sock))
+    await WebSocketServer(handler, listeners).run()
@@ -1,3 +1,29 @@
 BUSES_UPDATE_TIMEOUT = 0.25
 RECONNECT_TIMEOUT = 1
-SEND_UPDATES_TIMEOUT = 1
+GRID_CELL_SIZE = 0.01
+LAT_RANGE = (-90, 90)
+LNG_RANGE = (-180, 180)
+DELTA_SUBPROTOCOL = 'buses-delta'
+BINARY_SUBPROTOCOL = 'buses-binary'
+BROWSER_SUBPROTOCOLS = (DELTA_SUBPROTOCOL, BINARY_SUBPROTOCOL)
+BUSES_BATCH_MAX_SIZE = 1000
+BUS_TTL = 30
+EXPIRE_BUSES_TIMEOUT = 1
+ROUTES_CACHE_FILENAME = 'routes.cache'
+SEND_STATS_TIMEOUT = 5
+PROCESS_STOP_TIMEOUT = 5
+HUB_QUEUE_SIZE = 1000
+HUB_SOCKET_FILENAME = 'hub.sock'
+MAX_BUSES_UPDATE_TIMEOUT = 4
+BROWSER_SEND_TIMEOUT = 10
+SEND_LATENCY_SMOOTHING = 0.3
+SLOW_SEND_RATIO = 0.5
+FAST_SEND_RATIO = 0.1
+VIEWPORT_QUANTUM = 0.001
+VIEWPORT_CACHE_TTL = 0.1
+BUS_DICTIONARY_MAX_SIZE = 10000
+TRACKS_BUFFER_MAX_SIZE = 100000
+TRACKS_FLUSH_TIMEOUT = 1
+METRICS_REQUEST_TIMEOUT = 5
+METRICS_REQUEST_MAX_SIZE = 65536
+LOG_SAMPLE_RATE = 1000
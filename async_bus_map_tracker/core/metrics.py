@@ -0,0 +1,156 @@
+import logging
+from bisect import bisect_left
+from contextlib import suppress
+from dataclasses import dataclass, field
+
+import trio
+
+from async_bus_map_tracker.core import consts
+
+logger = logging.getLogger()
+
+COUNT_BUCKETS = (0, 1, 10, 100, 1000, 10000, 100000)
+SECONDS_BUCKETS = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 5, 10)
+
+
+@dataclass(kw_only=True, slots=True)
+class Counter:
+    name: str
+    description: str
+    value: float = 0
+
+    def inc(self, amount: float = 1) -> None:
+        self.value += amount
+
+    def render(self) -> list[str]:
+        return [f'# HELP {self.name} {self.description}', f'# TYPE {self.name} counter', f'{self.name} {self.value}']
+
+
+@dataclass(kw_only=True, slots=True)
+class Gauge:
+    name: str
+    description: str
+    value: float = 0
+
+    def inc(self, amount: float = 1) -> None:
+        self.value += amount
+
+    def dec(self, amount: float = 1) -> None:
+        self.value -= amount
+
+    def set(self, value: float) -> None:
+        self.value = value
+
+    def render(self) -> list[str]:
+        return [f'# HELP {self.name} {self.description}', f'# TYPE {self.name} gauge', f'{self.name} {self.value}']
+
+
+@dataclass(kw_only=True, slots=True)
+class Histogram:
+    """Histogram with fixed bucket upper bounds, observe only increments one bucket counter."""
+
+    name: str
+    description: str
+    buckets: tuple[float, ...] = SECONDS_BUCKETS
+    counts: list[int] = field(default_factory=list)
+    total: float = 0
+    count: int = 0
+
+    def __post_init__(self) -> None:
+        self.counts = [0] * (len(self.buckets) + 1)
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.total += value
+        self.count += 1
+
+    def render(self) -> list[str]:
+        lines = [f'# HELP {self.name} {self.description}', f'# TYPE {self.name} histogram']
+        cumulative_count = 0
+        for bucket, bucket_count in zip((*self.buckets, '+Inf'), self.counts):
+            cumulative_count += bucket_count
+            lines.append(f'{self.name}_bucket{{le="{bucket}"}} {cumulative_count}')
+        lines.append(f'{self.name}_sum {self.total}')
+        lines.append(f'{self.name}_count {self.count}')
+        return lines
+
+
+@dataclass(kw_only=True, slots=True)
+class ServerMetrics:
+    """Metrics of one server process rendered in the Prometheus text format."""
+
+    ingest_messages: Counter = field(default_factory=lambda: Counter(
+        name='tracker_ingest_messages_total',
+        description='Messages received from bus emulators.',
+    ))
+    ingest_buses: Counter = field(default_factory=lambda: Counter(
+        name='tracker_ingest_buses_total',
+        description='Bus positions received from bus emulators.',
+    ))
+    invalid_messages: Counter = field(default_factory=lambda: Counter(
+        name='tracker_invalid_messages_total',
+        description='Messages rejected by validation.',
+    ))
+    broadcast_buses: Histogram = field(default_factory=lambda: Histogram(
+        name='tracker_broadcast_buses',
+        description='Buses inside browser bounds per broadcast.',
+        buckets=COUNT_BUCKETS,
+    ))
+    encode_seconds: Histogram = field(default_factory=lambda: Histogram(
+        name='tracker_encode_seconds',
+        description='Time to prepare messages of one broadcast.',
+    ))
+    send_seconds: Histogram = field(default_factory=lambda: Histogram(
+        name='tracker_send_seconds',
+        description='Time for a browser websocket to accept messages of one broadcast.',
+    ))
+    skipped_frames: Counter = field(default_factory=lambda: Counter(
+        name='tracker_skipped_frames_total',
+        description='Broadcasts skipped for browsers which could not keep up.',
+    ))
+    browsers_connected: Gauge = field(default_factory=lambda: Gauge(
+        name='tracker_browsers_connected',
+        description='Connected browsers.',
+    ))
+    buses_registered: Gauge = field(default_factory=lambda: Gauge(
+        name='tracker_buses_registered',
+        description='Buses known to the server process.',
+    ))
+
+    def render(self) -> str:
+        lines = []
+        for metric_name in self.__slots__:
+            lines.extend(getattr(self, metric_name).render())
+        return '\n'.join(lines) + '\n'
+
+
+async def serve_metrics(metrics: ServerMetrics, host: str, port: int) -> None:
+    """Serve metrics over HTTP at /metrics."""
+
+    async def handle_request(stream: trio.SocketStream) -> None:
+        async with stream:
+            with suppress(trio.BrokenResourceError, trio.ClosedResourceError):
+                await respond(stream)
+
+    async def respond(stream: trio.SocketStream) -> None:
+        request = b''
+        with trio.move_on_after(consts.METRICS_REQUEST_TIMEOUT):
+            while b'\r\n\r\n' not in request and len(request) < consts.METRICS_REQUEST_MAX_SIZE:
+                data = await stream.receive_some()
+                if not data:
+                    break
+                request += data
+        request_line = request.split(b'\r\n', 1)[0].split()
+        if len(request_line) >= 2 and request_line[0] == b'GET' and request_line[1].split(b'?')[0] == b'/metrics':
+            status, body = '200 OK', metrics.render().encode()
+        else:
+            status, body = '404 Not Found', b'Not Found\n'
+        headers = (
+            f'HTTP/1.1 {status}\r\nContent-Type: text/plain; version=0.0.4; charset=utf-8\r\n'
+            f'Content-Length: {len(body)}\r\nConnection: close\r\n\r\n'
+        )
+        await stream.send_all(headers.encode() + body)
+
+    logger.info(f'Serve metrics on http://{host}:{port}/metrics')
+    await trio.serve_tcp(handle_request, port, host=host)
+
@@ -1,23 +1,42 @@
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 from enum import Enum
 
+from async_bus_map_tracker.core import consts
+
 
 class MessageTypes(Enum):
     BUSES = 'Buses'
+    BUSES_DELTA = 'BusesDelta'
     NEW_BOUNDS = 'newBounds'
 
     def __str__(self) -> str:
         return str(self.value)
 
-    @staticmethod
-    def exists(value) -> bool:
-        return value in set(item.value for item in MessageTypes)
+
+MESSAGE_TYPES = frozenset(item.value for item in MessageTypes)
+BROWSER_MESSAGE_TYPES = frozenset((MessageTypes.NEW_BOUNDS.value,))
+BUS_MESSAGE_TYPES = frozenset((MessageTypes.BUSES.value,))
+
+
+class BinaryMessageTypes(Enum):
+    BUSES_DICTIONARY = 1
+    BUSES = 2
 
 
 class MessageErrors(Enum):
     INVALID_JSON = 'Requires valid JSON'
     NO_MSG_TYPE = 'Requires msgType specified'
     NO_DATA_IN_BOUNDS = 'Requires data specified'
+    INVALID_BOUNDS = 'Requires finite numeric south_lat, north_lat, west_lng and east_lng'
+    INVALID_BUSES = 'Requires buses with string busId and route, lat from -90 to 90 and lng from -180 to 180'
+
+    def __str__(self) -> str:
+        return str(self.value)
+
+
+class SimulatorEngines(Enum):
+    TASKS = 'tasks'
+    FLEET = 'fleet'
 
     def __str__(self) -> str:
         return str(self.value)
@@ -34,9 +53,20 @@ class ConfigData:
     websockets_number: int = 0
     emulator_id: str = ''
     refresh_timeout: int = 0
+    engine: str = ''
+    processes: int = 0
+    workers: int = 0
+    tracks_dir: str = ''
+    metrics_port: int = 0
     logging: str = ''
 
 
+@dataclass(kw_only=True, slots=True)
+class SendStats:
+    buses: int = 0
+    frames: int = 0
+
+
 @dataclass(frozen=True, kw_only=True, slots=True)
 class Bus:
     busId: str
@@ -56,7 +86,28 @@ class WindowBounds:
         return (self.south_lat <= lat <= self.north_lat) and (self.west_lng <= lng <= self.east_lng)
 
     def update(self, south_lat: float, north_lat: float, west_lng: float, east_lng: float) -> None:
-        self.east_lng, self.north_lat, self.south_lat, self.west_lng = east_lng, north_lat, south_lat, west_lng
+        """Set bounds clamped to valid coordinates, zoomed out maps report longitudes beyond 180 degrees."""
+        min_lat, max_lat = consts.LAT_RANGE
+        min_lng, max_lng = consts.LNG_RANGE
+        self.south_lat = min(max(south_lat, min_lat), max_lat)
+        self.north_lat = min(max(north_lat, min_lat), max_lat)
+        self.west_lng = min(max(west_lng, min_lng), max_lng)
+        self.east_lng = min(max(east_lng, min_lng), max_lng)
+
+
+@dataclass(kw_only=True, slots=True)
+class BrowserSession:
+    """Browser connection state: window bounds and buses sent by the last message."""
+
+    bounds: WindowBounds = field(default_factory=WindowBounds)
+    is_delta: bool = False
+    is_binary: bool = False
+    needs_snapshot: bool = True
+    sent_buses: dict[str, Bus] = field(default_factory=dict)
+    bus_dictionary: dict[int, str] = field(default_factory=dict)
+    update_timeout: float = 0
+    send_latency: float = 0
+    skipped_frames: int = 0
 
 
 @dataclass(frozen=True, kw_only=True, slots=True)
@@ -0,0 +1,161 @@
+import json
+import logging
+import signal
+from collections.abc import AsyncIterator
+
+import trio
+
+from async_bus_map_tracker.core import consts
+from async_bus_map_tracker.core.models import Bus
+from async_bus_map_tracker.core.storage import BusesStorage
+from async_bus_map_tracker.core.validators import BUS_RANGES, BUS_SCHEMA, matches_schema
+
+logger = logging.getLogger()
+
+MAX_LINE_SIZE = 2 ** 24
+CONNECTION_ERRORS = (trio.BrokenResourceError, trio.ClosedResourceError)
+
+
+async def read_lines(stream: trio.abc.ReceiveStream) -> AsyncIterator[bytes]:
+    buffer = bytearray()
+    while data := await stream.receive_some():
+        buffer += data
+        *lines, rest = buffer.split(b'\n')
+        if len(rest) > MAX_LINE_SIZE:
+            raise ValueError('Hub message is too large')
+        for line in lines:
+            yield bytes(line)
+        buffer = bytearray(rest)
+
+
+async def write_lines(
+    stream: trio.abc.SendStream,
+    receive_channel: trio.MemoryReceiveChannel,
+    cancel_scope: trio.CancelScope,
+) -> None:
+    """Send queued lines until the connection fails, then cancel the other tasks of the connection."""
+    try:
+        async for line in receive_channel:
+            await stream.send_all(line)
+    except CONNECTION_ERRORS as exc:
+        logger.error(f'Hub connection failed exc={exc}')
+    cancel_scope.cancel()
+
+
+def parse_buses(line: bytes) -> list[Bus] | None:
+    """Return buses of the hub message or None if it is not a list of valid buses."""
+    try:
+        buses = json.loads(line)
+    except ValueError:
+        return None
+    if type(buses) is not list or not all(matches_schema(bus, BUS_SCHEMA, BUS_RANGES) for bus in buses):
+        return None
+    return [Bus(**bus) for bus in buses]
+
+
+async def serve_hub(socket_path: str, task_status=trio.TASK_STATUS_IGNORED) -> None:
+    """Forward bus updates published by one server worker to all other workers.
+
+    Every worker connection has its own bounded queue, updates for a worker which cannot keep up are dropped
+    instead of blocking the others: the next update of the same bus brings the position up to date.
+    Connection errors are handled inside the tasks of the connection, so a failed worker is only dropped
+    from the subscribers and never stops the hub.
+    """
+    subscribers: dict[trio.SocketStream, trio.MemorySendChannel] = {}
+
+    async def forward_lines(stream: trio.SocketStream, cancel_scope: trio.CancelScope) -> None:
+        try:
+            async for line in read_lines(stream):
+                for subscriber_stream, subscriber_channel in subscribers.items():
+                    if subscriber_stream is stream:
+                        continue
+                    try:
+                        subscriber_channel.send_nowait(line + b'\n')
+                    except trio.WouldBlock:
+                        logger.warning('Hub queue of a worker is full, bus update dropped')
+        except (*CONNECTION_ERRORS, ValueError) as exc:
+            logger.error(f'Worker connection failed exc={exc}')
+        logger.info('Worker disconnected from hub')
+        cancel_scope.cancel()
+
+    async def handle_worker(stream: trio.SocketStream) -> None:
+        send_channel, receive_channel = trio.open_memory_channel(consts.HUB_QUEUE_SIZE)
+        subscribers[stream] = send_channel
+        try:
+            async with stream, trio.open_nursery() as nursery:
+                nursery.start_soon(write_lines, stream, receive_channel, nursery.cancel_scope)
+                nursery.start_soon(forward_lines, stream, nursery.cancel_scope)
+        finally:
+            del subscribers[stream]
+
+    sock = trio.socket.socket(trio.socket.AF_UNIX, trio.socket.SOCK_STREAM)
+    await sock.bind(socket_path)
+    sock.listen()
+    listener = trio.SocketListener(sock)
+    task_status.started()
+    await trio.serve_listeners(handle_worker, [listener])
+
+
+async def run_hub(socket_path: str) -> None:
+    """Serve hub until the launcher receives SIGINT or SIGTERM."""
+    with trio.open_signal_receiver(signal.SIGINT, signal.SIGTERM) as signals:
+        async with trio.open_nursery() as nursery:
+            nursery.start_soon(serve_hub, socket_path)
+            async for signal_number in signals:
+                logger.info(f'Hub stopped by signal {signal_number}')
+                nursery.cancel_scope.cancel()
+
+
+async def exchange_buses(
+    socket_path: str,
+    registered_buses: BusesStorage,
+    publish_channel: trio.MemoryReceiveChannel,
+) -> None:
+    """Publish buses received by this server worker to the hub and apply buses received by other workers.
+
+    Args:
+        socket_path: unix socket path of the hub;
+        registered_buses: all busses data from clients;
+        publish_channel: lists of bus dicts received from emulators by this worker.
+    """
+    async def publish(stream: trio.SocketStream, cancel_scope: trio.CancelScope) -> None:
+        try:
+            async for buses in publish_channel:
+                await stream.send_all(json.dumps(buses).encode() + b'\n')
+        except CONNECTION_ERRORS as exc:
+            logger.error(f'Hub connection failed exc={exc}')
+        cancel_scope.cancel()
+
+    async def apply_updates(stream: trio.SocketStream, cancel_scope: trio.CancelScope) -> None:
+        try:
+            async for line in read_lines(stream):
+                buses = parse_buses(line)
+                if buses is None:
+                    logger.warning('Invalid hub message skipped')
+                    continue
+                for bus in buses:
+                    registered_buses.update(bus)
+        except (*CONNECTION_ERRORS, ValueError) as exc:
+            logger.error(f'Hub connection failed exc={exc}')
+        cancel_scope.cancel()
+
+    while True:
+        try:
+            stream = await trio.open_unix_socket(socket_path)
+        except OSError as exc:
+            logger.error(f'Hub connection failed exc={exc}')
+        else:
+            async with stream, trio.open_nursery() as nursery:
+                nursery.start_soon(publish, stream, nursery.cancel_scope)
+                nursery.start_soon(apply_updates, stream, nursery.cancel_scope)
+        logger.info(f'Reconnect to hub in {consts.RECONNECT_TIMEOUT} seconds')
+        await trio.sleep(consts.RECONNECT_TIMEOUT)
+
+
+def publish_buses(publish_channel: trio.MemorySendChannel | None, buses: list[dict]) -> None:
+    if publish_channel is None:
+        return
+    try:
+        publish_channel.send_nowait(buses)
+    except trio.WouldBlock:
+        logger.warning('Hub publish queue is full, bus update dropped')
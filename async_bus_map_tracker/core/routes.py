@@ -1,14 +1,131 @@
+import hashlib
 import json
+import mmap
 import os
+import struct
+import sys
+from array import array
+from collections.abc import Iterator
+from dataclasses import dataclass
+from random import randint
+
+from async_bus_map_tracker.core import consts
+
+CACHE_MAGIC = b'BUSROUTE'
+CACHE_HEADER_SIZE = struct.Struct('<8sQ')
+COORDINATE_SIZE = array('d').itemsize
+
+
+@dataclass(frozen=True, slots=True)
+class Route:
+    """Bus route with coordinates stored as flat lat, lng pairs of doubles."""
+
+    name: str
+    points: memoryview
+
+    def __len__(self) -> int:
+        return len(self.points) // 2
+
+    def get_point(self, cursor: int) -> tuple[float, float]:
+        return self.points[2 * cursor], self.points[2 * cursor + 1]
 
 
 def generate_bus_id(route_id, bus_index):
     return f"{route_id}-{bus_index}"
 
 
-def load_routes(directory_path='routes'):
-    for filename in os.listdir(directory_path):
-        if filename.endswith(".json"):
-            filepath = os.path.join(directory_path, filename)
-            with open(filepath, 'r', encoding='utf8') as file:
-                yield json.load(file)
+def get_random_cursor(points_count: int) -> tuple[int, int]:
+    """Pick random position on the route driven forth and back.
+
+    Returns:
+        point index and direction: 1 forth, -1 back.
+    """
+    position = randint(0, 2 * points_count - 1)
+    if position < points_count:
+        return position, 1
+    return 2 * points_count - 1 - position, -1
+
+
+def move_cursor(cursor: int, direction: int, points_count: int) -> tuple[int, int]:
+    """Move to the next route point, the bus turns back at the last stop and stays there for one step."""
+    next_cursor = cursor + direction
+    if 0 <= next_cursor < points_count:
+        return next_cursor, direction
+    return cursor, -direction
+
+
+def get_routes_fingerprint(directory_path: str) -> str:
+    """Hash names, sizes and modification times of route JSON files."""
+    fingerprint = hashlib.sha1(sys.byteorder.encode())
+    for entry in sorted(os.scandir(directory_path), key=lambda entry: entry.name):
+        if entry.name.endswith('.json'):
+            stat = entry.stat()
+            fingerprint.update(f'{entry.name}:{stat.st_size}:{stat.st_mtime_ns};'.encode())
+    return fingerprint.hexdigest()
+
+
+def build_routes_cache(directory_path: str, cache_path: str, fingerprint: str) -> None:
+    """Parse route JSON files once and store their coordinates in one binary file.
+
+    File layout: magic, index length, JSON index with route names and offsets, padding to the coordinate
+    size and coordinates of all routes as native doubles.
+    """
+    index, points = [], array('d')
+    for filename in sorted(os.listdir(directory_path)):
+        if filename.endswith('.json'):
+            with open(os.path.join(directory_path, filename), 'r', encoding='utf8') as file:
+                route = json.load(file)
+            index.append((route['name'], len(points), len(route['coordinates']) * 2))
+            for lat, lng in route['coordinates']:
+                points.append(lat)
+                points.append(lng)
+
+    encoded_index = json.dumps({'fingerprint': fingerprint, 'routes': index}).encode()
+    padding = -(CACHE_HEADER_SIZE.size + len(encoded_index)) % COORDINATE_SIZE
+    temp_path = f'{cache_path}.{os.getpid()}.tmp'
+    with open(temp_path, 'wb') as file:
+        file.write(CACHE_HEADER_SIZE.pack(CACHE_MAGIC, len(encoded_index)))
+        file.write(encoded_index)
+        file.write(b'\0' * padding)
+        points.tofile(file)
+    os.replace(temp_path, cache_path)
+
+
+def read_routes_cache(cache_path: str, fingerprint: str) -> tuple[list, memoryview] | None:
+    """Map routes cache file into memory.
+
+    Returns:
+        routes index and all coordinates or None when the cache is missing or outdated.
+    """
+    try:
+        with open(cache_path, 'rb') as file:
+            cache = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+    except (FileNotFoundError, ValueError):
+        return None
+    if len(cache) < CACHE_HEADER_SIZE.size:
+        return None
+    magic, index_size = CACHE_HEADER_SIZE.unpack_from(cache)
+    if magic != CACHE_MAGIC:
+        return None
+    index_end = CACHE_HEADER_SIZE.size + index_size
+    index = json.loads(cache[CACHE_HEADER_SIZE.size:index_end])
+    if index['fingerprint'] != fingerprint:
+        return None
+    points_start = index_end + (-index_end % COORDINATE_SIZE)
+    return index['routes'], memoryview(cache)[points_start:].cast('d')
+
+
+def load_routes(directory_path='routes', cache_path=None) -> Iterator[Route]:
+    """Iterate over routes from the binary cache, rebuilding it when route JSON files change.
+
+    Routes are slices of the memory-mapped cache, so only iterated routes are touched.
+    """
+    cache_path = cache_path or os.path.join(directory_path, consts.ROUTES_CACHE_FILENAME)
+    fingerprint = get_routes_fingerprint(directory_path)
+    cache = read_routes_cache(cache_path, fingerprint)
+    if cache is None:
+        build_routes_cache(directory_path, cache_path, fingerprint)
+        cache = read_routes_cache(cache_path, fingerprint)
+    routes_index, points = cache
+    for name, offset, size in routes_index:
+        yield Route(name=name, points=points[offset:offset + size])
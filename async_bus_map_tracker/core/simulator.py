@@ -0,0 +1,50 @@
+from array import array
+from dataclasses import dataclass, field
+
+from async_bus_map_tracker.core.routes import generate_bus_id, get_random_cursor, Route
+
+
+@dataclass(kw_only=True, slots=True)
+class Fleet:
+    """Positions of all emulated buses as parallel arrays advanced together on every tick."""
+
+    routes: list[Route] = field(default_factory=list)
+    route_ids: list[str] = field(default_factory=list)
+    bus_ids: list[str] = field(default_factory=list)
+    bus_routes: array = field(default_factory=lambda: array('l'))
+    cursors: array = field(default_factory=lambda: array('l'))
+    directions: array = field(default_factory=lambda: array('b'))
+
+    def __len__(self) -> int:
+        return len(self.bus_ids)
+
+    def add_route(self, route: Route, route_id: str, buses_amount: int) -> None:
+        route_index = len(self.routes)
+        self.routes.append(route)
+        self.route_ids.append(route_id)
+        for bus_index in range(buses_amount):
+            cursor, direction = get_random_cursor(len(route))
+            self.bus_ids.append(generate_bus_id(route_id, bus_index))
+            self.bus_routes.append(route_index)
+            self.cursors.append(cursor)
+            self.directions.append(direction)
+
+    def advance(self) -> list[dict]:
+        """Get current positions of all buses and move them to the next route points."""
+        buses = []
+        points_counts = [len(route) for route in self.routes]
+        cursors, directions = self.cursors, self.directions
+        for bus_number, route_index in enumerate(self.bus_routes):
+            points, cursor, direction = self.routes[route_index].points, cursors[bus_number], directions[bus_number]
+            buses.append({
+                'busId': self.bus_ids[bus_number],
+                'lat': points[2 * cursor],
+                'lng': points[2 * cursor + 1],
+                'route': self.route_ids[route_index],
+            })
+            next_cursor = cursor + direction
+            if 0 <= next_cursor < points_counts[route_index]:
+                cursors[bus_number] = next_cursor
+            else:
+                directions[bus_number] = -direction
+        return buses
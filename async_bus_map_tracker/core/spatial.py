@@ -0,0 +1,72 @@
+from collections.abc import Iterator
+from dataclasses import dataclass, field
+from math import floor
+
+from async_bus_map_tracker.core import consts
+from async_bus_map_tracker.core.models import WindowBounds
+
+Cell = tuple[int, int]
+
+
+@dataclass(kw_only=True, slots=True)
+class GridIndex:
+    """Uniform lat/lng grid which maps cells to ids of items located inside them."""
+
+    cell_size: float = consts.GRID_CELL_SIZE
+    cells: dict[Cell, set[str]] = field(default_factory=dict)
+    item_cells: dict[str, Cell] = field(default_factory=dict)
+
+    def get_cell(self, lat: float, lng: float) -> Cell:
+        return floor(lat / self.cell_size), floor(lng / self.cell_size)
+
+    def move(self, item_id: str, lat: float, lng: float) -> None:
+        cell = self.get_cell(lat, lng)
+        old_cell = self.item_cells.get(item_id)
+        if old_cell == cell:
+            return
+        if old_cell is not None:
+            self._discard(item_id, old_cell)
+        self.cells.setdefault(cell, set()).add(item_id)
+        self.item_cells[item_id] = cell
+
+    def remove(self, item_id: str) -> None:
+        cell = self.item_cells.pop(item_id, None)
+        if cell is not None:
+            self._discard(item_id, cell)
+
+    def find(self, bounds: WindowBounds) -> Iterator[tuple[set[str], bool]]:
+        """Iterate over item ids of cells overlapping bounds.
+
+        Yields:
+            set of item ids and a flag whether the cell lies on the bounds border,
+            so its items should be checked with WindowBounds.is_inside.
+        """
+        south_row, west_col = self.get_cell(bounds.south_lat, bounds.west_lng)
+        north_row, east_col = self.get_cell(bounds.north_lat, bounds.east_lng)
+        if south_row > north_row or west_col > east_col:
+            return
+
+        bounds_cells_amount = (north_row - south_row + 1) * (east_col - west_col + 1)
+        if bounds_cells_amount <= len(self.cells):
+            cells = (
+                ((row, col), self.cells.get((row, col)))
+                for row in range(south_row, north_row + 1)
+                for col in range(west_col, east_col + 1)
+            )
+        else:
+            cells = (
+                (cell, item_ids)
+                for cell, item_ids in self.cells.items()
+                if south_row <= cell[0] <= north_row and west_col <= cell[1] <= east_col
+            )
+
+        for (row, col), item_ids in cells:
+            if item_ids:
+                is_border = row in (south_row, north_row) or col in (west_col, east_col)
+                yield item_ids, is_border
+
+    def _discard(self, item_id: str, cell: Cell) -> None:
+        item_ids = self.cells[cell]
+        item_ids.discard(item_id)
+        if not item_ids:
+            del self.cells[cell]
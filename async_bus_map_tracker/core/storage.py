@@ -0,0 +1,89 @@
+import heapq
+import time
+from dataclasses import dataclass, field
+
+from async_bus_map_tracker.core import consts
+from async_bus_map_tracker.core.broadcast import BusesFragments, BusIndexes, Viewport, ViewportCache
+from async_bus_map_tracker.core.models import Bus, WindowBounds
+from async_bus_map_tracker.core.spatial import GridIndex
+
+
+@dataclass(kw_only=True, slots=True)
+class BusesStorage:
+    """Registered buses with a spatial index for bounds lookups, a cache of their JSON fragments
+    and their indexes in binary messages.
+
+    Buses not updated for ttl seconds are removed by expire. The expiry heap holds one deadline per bus,
+    a deadline of a bus updated meanwhile is moved forward when it is popped instead of on every update.
+    """
+
+    ttl: float = consts.BUS_TTL
+    buses: dict[str, Bus] = field(default_factory=dict)
+    index: GridIndex = field(default_factory=GridIndex)
+    fragments: BusesFragments = field(default_factory=BusesFragments)
+    bus_indexes: BusIndexes = field(default_factory=BusIndexes)
+    viewports: ViewportCache = field(default_factory=ViewportCache)
+    last_seen: dict[str, float] = field(default_factory=dict)
+    deadlines: dict[str, float] = field(default_factory=dict)
+    expiry_heap: list[tuple[float, str]] = field(default_factory=list)
+
+    def __len__(self) -> int:
+        return len(self.buses)
+
+    def __contains__(self, bus_id: str) -> bool:
+        return bus_id in self.buses
+
+    def update(self, bus: Bus, now: float | None = None) -> None:
+        now = time.monotonic() if now is None else now
+        self.buses[bus.busId] = bus
+        self.index.move(bus.busId, bus.lat, bus.lng)
+        self.last_seen[bus.busId] = now
+        if bus.busId not in self.deadlines:
+            self._schedule(bus.busId, now + self.ttl)
+
+    def remove(self, bus_id: str) -> None:
+        self.buses.pop(bus_id, None)
+        self.index.remove(bus_id)
+        self.fragments.discard(bus_id)
+        self.bus_indexes.discard(bus_id)
+        self.last_seen.pop(bus_id, None)
+        self.deadlines.pop(bus_id, None)
+
+    def expire(self, now: float | None = None) -> list[str]:
+        """Remove buses not updated for ttl seconds.
+
+        Returns:
+            ids of removed buses.
+        """
+        now = time.monotonic() if now is None else now
+        expired_bus_ids = []
+        while self.expiry_heap and self.expiry_heap[0][0] <= now:
+            deadline, bus_id = heapq.heappop(self.expiry_heap)
+            if self.deadlines.get(bus_id) != deadline:
+                continue
+            actual_deadline = self.last_seen[bus_id] + self.ttl
+            if actual_deadline > now:
+                self._schedule(bus_id, actual_deadline)
+            else:
+                self.remove(bus_id)
+                expired_bus_ids.append(bus_id)
+        return expired_bus_ids
+
+    def find_inside(self, bounds: WindowBounds) -> list[Bus]:
+        buses = []
+        for bus_ids, is_border in self.index.find(bounds):
+            if is_border:
+                buses.extend(
+                    bus for bus in map(self.buses.__getitem__, bus_ids) if bounds.is_inside(bus.lat, bus.lng)
+                )
+            else:
+                buses.extend(map(self.buses.__getitem__, bus_ids))
+        return buses
+
+    def find_viewport(self, bounds: WindowBounds, now: float | None = None) -> Viewport:
+        now = time.monotonic() if now is None else now
+        return self.viewports.get(bounds, self.find_inside, now)
+
+    def _schedule(self, bus_id: str, deadline: float) -> None:
+        self.deadlines[bus_id] = deadline
+        heapq.heappush(self.expiry_heap, (deadline, bus_id))
@@ -1,10 +1,49 @@
-from json import loads
+import os
+from array import array
+from contextlib import suppress
+from dataclasses import asdict
+from json import dump, dumps, loads
+from struct import unpack_from
+from random import uniform
 
 import pytest
-from trio_websocket import open_websocket_url
+import trio
+from trio_websocket import open_websocket_url, serve_websocket
 
+from async_bus_map_tracker.core import consts
+from async_bus_map_tracker.core.broadcast import (
+    build_binary_messages,
+    BusesFragments,
+    BusIndexes,
+    prepare_buses_message,
+    prepare_buses_messages,
+    Viewport,
+    ViewportCache,
+)
 from async_bus_map_tracker.core.config import configure_application
-from async_bus_map_tracker.core.models import MessageErrors
+from async_bus_map_tracker.core.metrics import Histogram, ServerMetrics
+from async_bus_map_tracker.core.models import BrowserSession, Bus, ConfigData, MessageErrors, SendStats, WindowBounds
+from async_bus_map_tracker.core.pubsub import exchange_buses, serve_hub
+from async_bus_map_tracker.core.routes import get_routes_fingerprint, load_routes, move_cursor, Route
+from async_bus_map_tracker.core.simulator import Fleet
+from async_bus_map_tracker.core.storage import BusesStorage
+from async_bus_map_tracker.core.throttling import adapt_update_timeout, schedule_next_update
+from async_bus_map_tracker.core.tracks import read_tracks, TrackRecorder
+from async_bus_map_tracker.core.validators import (
+    BOUNDS_RANGES,
+    BOUNDS_SCHEMA,
+    BUS_RANGES,
+    BUS_SCHEMA,
+    JsonMessageValidator,
+    matches_schema,
+)
+from async_bus_map_tracker.fake_bus import (
+    collect_updates,
+    get_shard_routes,
+    limit_processes,
+    pop_pending_batches,
+    send_updates,
+)
 
 config_data = configure_application(is_test=True)
 SERVER_HOST = f'{config_data.server_protocol}{config_data.server_host}'
@@ -31,8 +70,16 @@ async def browser_bus_client():
         MessageErrors.NO_MSG_TYPE.value,
     ),
     (
-        '{"msgType": "newBounds", "1": {"east_lng": 37.0, "north_lat": 55.0, "south_lat": 55.0, "west_lng": 37.5}}',
-        MessageErrors.NO_DATA_IN_BOUNDS.value,
+        '{"msgType": "Buses", "buses": {"busId": "c790сс", "lat": 1e308, "lng": 37.6, "route": "120"}}',
+        MessageErrors.INVALID_BUSES.value,
+    ),
+    (
+        '{"msgType": "Buses", "buses": [{"busId": "c790сс", "lat": 55.75, "lng": -180.5, "route": "120"}]}',
+        MessageErrors.INVALID_BUSES.value,
+    ),
+    (
+        '{"msgType": "newBounds", "data": {"east_lng": 37.6, "north_lat": 55.8, "south_lat": 55.7, "west_lng": 37.5}}',
+        MessageErrors.NO_MSG_TYPE.value,
     ),
 ])
 async def test_server_client(server_client, payload, error):
@@ -57,8 +104,506 @@ async def get_error_message(ws):
         '{"buses": [{"busId": "c790сс", "lat": 55.7500, "lng": 37.600, "route": "120"}]}',
         MessageErrors.NO_MSG_TYPE.value,
     ),
+    (
+        '{"msgType": "newBounds", "1": {"east_lng": 37.0, "north_lat": 55.0, "south_lat": 55.0, "west_lng": 37.5}}',
+        MessageErrors.NO_DATA_IN_BOUNDS.value,
+    ),
 ])
 async def test_browser_client(browser_bus_client, payload, error):
     await browser_bus_client.send_message(payload)
     response = await get_error_message(browser_bus_client)
     assert response == f'{{"errors": ["{error}"], "msgType": "Errors"}}'
+
+
+@pytest.mark.parametrize('bounds', [
+    WindowBounds(south_lat=55.726, north_lat=55.774, west_lng=37.544, east_lng=37.656),
+    WindowBounds(south_lat=55.7, north_lat=55.7001, west_lng=37.6, east_lng=37.6001),
+    WindowBounds(south_lat=55.0, north_lat=56.0, west_lng=37.0, east_lng=38.0),
+    WindowBounds(south_lat=55.8, north_lat=55.7, west_lng=37.5, east_lng=37.6),
+])
+def test_buses_storage_find_inside(bounds):
+    registered_buses = BusesStorage()
+    for bus_index in range(1000):
+        bus = Bus(busId=str(bus_index), lat=uniform(55.6, 55.9), lng=uniform(37.4, 37.8), route='1')
+        registered_buses.update(bus)
+    registered_buses.update(Bus(busId='0', lat=55.75, lng=37.6, route='1'))
+    registered_buses.remove('1')
+
+    expected_ids = {bus.busId for bus in registered_buses.buses.values() if bounds.is_inside(bus.lat, bus.lng)}
+    assert {bus.busId for bus in registered_buses.find_inside(bounds)} == expected_ids
+    assert '1' not in registered_buses.index.item_cells
+
+
+def make_viewport(buses: list[Bus]) -> Viewport:
+    return Viewport(bounds=WindowBounds(), buses={bus.busId: bus for bus in buses}, expires_at=0)
+
+
+def test_prepare_buses_delta_message():
+    session = BrowserSession(is_delta=True)
+    fragments = BusesFragments()
+    first_bus = Bus(busId='1', lat=55.75, lng=37.6, route='1')
+    second_bus = Bus(busId='2', lat=55.76, lng=37.6, route='1')
+    third_bus = Bus(busId='3', lat=55.77, lng=37.6, route='2')
+
+    snapshot = loads(prepare_buses_message(session, make_viewport([first_bus, second_bus]), fragments))
+    assert snapshot['msgType'] == 'Buses'
+    assert [bus['busId'] for bus in snapshot['buses']] == ['1', '2']
+
+    unchanged_buses = [first_bus, Bus(busId='2', lat=55.76, lng=37.6, route='1')]
+    assert prepare_buses_message(session, make_viewport(unchanged_buses), fragments) is None
+
+    moved_bus = Bus(busId='1', lat=55.751, lng=37.6, route='1')
+    delta = loads(prepare_buses_message(session, make_viewport([moved_bus, third_bus]), fragments))
+    assert delta['msgType'] == 'BusesDelta'
+    assert [bus['busId'] for bus in delta['added']] == ['3']
+    assert delta['moved'] == [{'busId': '1', 'lat': 55.751, 'lng': 37.6, 'route': '1'}]
+    assert delta['removed'] == ['2']
+
+    session.needs_snapshot = True
+    assert loads(prepare_buses_message(session, make_viewport([third_bus]), fragments))['msgType'] == 'Buses'
+
+
+def test_buses_fragments_cache():
+    fragments = BusesFragments()
+    bus = Bus(busId='1', lat=55.75, lng=37.6, route='120')
+    assert fragments.encode(bus) == dumps(asdict(bus))
+    assert fragments.encode(bus) is fragments.encode(bus)
+
+    moved_bus = Bus(busId='1', lat=55.76, lng=37.6, route='120')
+    assert loads(fragments.encode_list([moved_bus])) == [asdict(moved_bus)]
+    fragments.discard('1')
+    assert not fragments.fragments
+
+
+def test_buses_storage_expire_with_churn():
+    registered_buses = BusesStorage(ttl=10)
+    for second in range(100):
+        registered_buses.update(Bus(busId='constant', lat=55.75, lng=37.6, route='1'), now=second)
+        for bus_index in range(50):
+            bus = Bus(busId=f'{second}-{bus_index}', lat=uniform(55.6, 55.9), lng=uniform(37.4, 37.8), route='2')
+            registered_buses.update(bus, now=second)
+            registered_buses.fragments.encode(bus)
+        registered_buses.expire(now=second)
+
+        assert len(registered_buses) <= 10 * 50 + 1
+        assert len(registered_buses.expiry_heap) <= len(registered_buses) + 50
+        assert len(registered_buses.fragments.fragments) == len(registered_buses) - 1
+        assert len(registered_buses.index.item_cells) == len(registered_buses)
+
+    assert 'constant' in registered_buses
+    assert registered_buses.expire(now=200) and not registered_buses.buses
+    assert not (registered_buses.index.cells or registered_buses.last_seen or registered_buses.deadlines)
+
+
+def test_move_cursor_drives_route_forth_and_back():
+    cursor, direction, cursors = 0, 1, []
+    for _ in range(8):
+        cursors.append(cursor)
+        cursor, direction = move_cursor(cursor, direction, 3)
+    assert cursors == [0, 1, 2, 2, 1, 0, 0, 1]
+
+
+def write_route(directory_path, name: str, coordinates: list[list[float]]) -> None:
+    with open(directory_path / f'{name}.json', 'w', encoding='utf8') as file:
+        dump({'name': name, 'coordinates': coordinates}, file)
+
+
+def test_load_routes_rebuilds_cache_on_changes(tmp_path):
+    write_route(tmp_path, '120', [[55.75, 37.6], [55.76, 37.61]])
+    write_route(tmp_path, '670к', [[55.7, 37.5], [55.71, 37.51], [55.72, 37.52]])
+    routes = {route.name: route for route in load_routes(str(tmp_path))}
+    assert {name: route.points.tolist() for name, route in routes.items()} == {
+        '120': [55.75, 37.6, 55.76, 37.61],
+        '670к': [55.7, 37.5, 55.71, 37.51, 55.72, 37.52],
+    }
+    assert routes['670к'].get_point(2) == (55.72, 37.52)
+    cache_inode = (tmp_path / 'routes.cache').stat().st_ino
+    fingerprint = get_routes_fingerprint(str(tmp_path))
+
+    assert [route.name for route in load_routes(str(tmp_path))] == ['120', '670к']
+    assert (tmp_path / 'routes.cache').stat().st_ino == cache_inode
+
+    route_path = tmp_path / '120.json'
+    os.utime(route_path, ns=(route_path.stat().st_atime_ns, route_path.stat().st_mtime_ns + 10 ** 9))
+    touched_fingerprint = get_routes_fingerprint(str(tmp_path))
+    assert touched_fingerprint != fingerprint
+    assert [route.name for route in load_routes(str(tmp_path))] == ['120', '670к']
+    assert (tmp_path / 'routes.cache').stat().st_ino != cache_inode
+
+    write_route(tmp_path, '120', [[55.8, 37.7]])
+    assert get_routes_fingerprint(str(tmp_path)) not in (fingerprint, touched_fingerprint)
+    routes = {route.name: route for route in load_routes(str(tmp_path))}
+    assert routes['120'].points.tolist() == [55.8, 37.7]
+    assert routes['670к'].points.tolist() == [55.7, 37.5, 55.71, 37.51, 55.72, 37.52]
+
+
+@pytest.mark.parametrize('processes', [1, 2, 3])
+def test_shard_routes_split_first_routes_between_processes(tmp_path, processes):
+    for route_number in range(7):
+        write_route(tmp_path, f'{route_number}', [[55.75, 37.6]])
+    route_names = [route.name for route in load_routes(str(tmp_path))]
+    shards = [
+        [route.name for route in get_shard_routes(load_routes(str(tmp_path)), shard_index, processes, 5)]
+        for shard_index in range(processes)
+    ]
+    assert sum(len(shard) for shard in shards) == 5
+    assert set().union(*shards) == set(route_names[:5])
+
+
+@pytest.mark.parametrize('processes, routes_count, expected_processes', [(3, 5, 3), (8, 5, 5), (2, 0, 1)])
+def test_limit_processes_to_routes_count(tmp_path, processes, routes_count, expected_processes):
+    for route_number in range(routes_count):
+        write_route(tmp_path, f'{route_number}', [[55.75, 37.6]])
+    config_data = limit_processes(ConfigData(processes=processes, routes_number=10), routes_count)
+    assert config_data.processes == expected_processes
+    for shard_index in range(min(config_data.processes, routes_count)):
+        assert list(get_shard_routes(load_routes(str(tmp_path)), shard_index, config_data.processes, 10))
+
+
+@pytest.mark.trio
+async def test_collect_updates_coalesces_bus_positions():
+    send_channel, receive_channel = trio.open_memory_channel(10)
+    wakeup_send_channel, wakeup_receive_channel = trio.open_memory_channel(1)
+    pending_buses = {}
+    for lat in (55.75, 55.76, 55.77):
+        send_channel.send_nowait([{'busId': 'c790сс', 'lat': lat, 'lng': 37.6, 'route': '120'}])
+    send_channel.send_nowait([{'busId': 'a134aa', 'lat': 55.7, 'lng': 37.5, 'route': '670к'}])
+    send_channel.close()
+
+    await collect_updates(receive_channel, pending_buses, wakeup_send_channel)
+    wakeup_receive_channel.receive_nowait()
+    with pytest.raises(trio.WouldBlock):
+        wakeup_receive_channel.receive_nowait()
+    assert pop_pending_batches(pending_buses) == [[
+        {'busId': 'c790сс', 'lat': 55.77, 'lng': 37.6, 'route': '120'},
+        {'busId': 'a134aa', 'lat': 55.7, 'lng': 37.5, 'route': '670к'},
+    ]]
+    assert pop_pending_batches(pending_buses) == []
+
+
+def test_send_updates_reconnects_after_server_drops_connection(monkeypatch):
+    monkeypatch.setattr(consts, 'RECONNECT_TIMEOUT', 0.01)
+    received_messages = []
+
+    async def handle_connection(request) -> None:
+        ws = await request.accept()
+        received_messages.append(loads(await ws.get_message()))
+        if len(received_messages) == 1:
+            await ws.aclose()
+        else:
+            await trio.sleep_forever()
+
+    async def run_sender() -> None:
+        pending_buses = {}
+        wakeup_send_channel, wakeup_receive_channel = trio.open_memory_channel(1)
+        async with trio.open_nursery() as nursery:
+            server = await nursery.start(serve_websocket, handle_connection, '127.0.0.1', 0, None)
+            server_address = f'ws://127.0.0.1:{server.port}'
+            nursery.start_soon(send_updates, server_address, pending_buses, wakeup_receive_channel, SendStats())
+            with trio.fail_after(5):
+                while len(received_messages) < 2:
+                    pending_buses['c790сс'] = {'busId': 'c790сс', 'lat': 55.75, 'lng': 37.6, 'route': '120'}
+                    with suppress(trio.WouldBlock):
+                        wakeup_send_channel.send_nowait(None)
+                    await trio.sleep(0.05)
+            nursery.cancel_scope.cancel()
+
+    # Errors of nursery children are always wrapped in exception groups in strict mode, the default of trio 0.25.
+    trio.run(run_sender, strict_exception_groups=True)
+    assert received_messages[1]['buses'][0]['busId'] == 'c790сс'
+
+
+async def publish_until_received(
+    publish_channel: trio.MemorySendChannel,
+    bus: dict,
+    registered_buses: BusesStorage,
+) -> None:
+    """Publish the bus until the other worker gets it, workers connect to the hub in the background."""
+    with trio.fail_after(5):
+        while bus['busId'] not in registered_buses:
+            publish_channel.send_nowait([bus])
+            await trio.sleep(0.05)
+
+
+@pytest.mark.trio
+async def test_hub_forwards_buses_to_other_workers(tmp_path):
+    socket_path = str(tmp_path / 'hub.sock')
+    first_buses, second_buses = BusesStorage(), BusesStorage()
+    first_send_channel, first_receive_channel = trio.open_memory_channel(10)
+    second_send_channel, second_receive_channel = trio.open_memory_channel(10)
+    first_bus = {'busId': 'c790сс', 'lat': 55.75, 'lng': 37.6, 'route': '120'}
+    second_bus = {'busId': 'a134aa', 'lat': 55.7, 'lng': 37.5, 'route': '670к'}
+
+    async with trio.open_nursery() as nursery:
+        await nursery.start(serve_hub, socket_path)
+        nursery.start_soon(exchange_buses, socket_path, first_buses, first_receive_channel)
+        nursery.start_soon(exchange_buses, socket_path, second_buses, second_receive_channel)
+        await publish_until_received(first_send_channel, first_bus, second_buses)
+        await publish_until_received(second_send_channel, second_bus, first_buses)
+        nursery.cancel_scope.cancel()
+
+    assert second_buses.buses['c790сс'] == Bus(**first_bus)
+    assert 'c790сс' not in first_buses
+    assert 'a134aa' not in second_buses
+
+
+def test_hub_skips_invalid_lines_and_drops_disconnected_workers(tmp_path, monkeypatch):
+    monkeypatch.setattr(consts, 'RECONNECT_TIMEOUT', 0.01)
+    socket_path = str(tmp_path / 'hub.sock')
+    first_buses, second_buses = BusesStorage(), BusesStorage()
+    first_send_channel, first_receive_channel = trio.open_memory_channel(10)
+    second_send_channel, second_receive_channel = trio.open_memory_channel(10)
+
+    async def exchange_through_hub() -> None:
+        async with trio.open_nursery() as nursery:
+            await nursery.start(serve_hub, socket_path)
+            nursery.start_soon(exchange_buses, socket_path, first_buses, first_receive_channel)
+            nursery.start_soon(exchange_buses, socket_path, second_buses, second_receive_channel)
+            bus = {'busId': 'c790сс', 'lat': 55.75, 'lng': 37.6, 'route': '120'}
+            await publish_until_received(first_send_channel, bus, second_buses)
+
+            broken_stream = await trio.open_unix_socket(socket_path)
+            await broken_stream.send_all(b'not json\n{"busId": "a134aa"}\n[{"busId": "a134aa", "lat": 555}]\n')
+            await broken_stream.aclose()
+            bus = {'busId': 'a134aa', 'lat': 55.7, 'lng': 37.5, 'route': '670к'}
+            await publish_until_received(second_send_channel, bus, first_buses)
+            nursery.cancel_scope.cancel()
+
+    trio.run(exchange_through_hub, strict_exception_groups=True)
+    assert first_buses.buses['a134aa'] == Bus(busId='a134aa', lat=55.7, lng=37.5, route='670к')
+
+
+def test_workers_reconnect_to_restarted_hub(tmp_path, monkeypatch):
+    monkeypatch.setattr(consts, 'RECONNECT_TIMEOUT', 0.01)
+    socket_path = str(tmp_path / 'hub.sock')
+    first_buses, second_buses = BusesStorage(), BusesStorage()
+    first_send_channel, first_receive_channel = trio.open_memory_channel(10)
+    second_send_channel, second_receive_channel = trio.open_memory_channel(10)
+
+    async def exchange_through_restarted_hub() -> None:
+        async with trio.open_nursery() as nursery:
+            async with trio.open_nursery() as hub_nursery:
+                await hub_nursery.start(serve_hub, socket_path)
+                nursery.start_soon(exchange_buses, socket_path, first_buses, first_receive_channel)
+                nursery.start_soon(exchange_buses, socket_path, second_buses, second_receive_channel)
+                bus = {'busId': 'c790сс', 'lat': 55.75, 'lng': 37.6, 'route': '120'}
+                await publish_until_received(first_send_channel, bus, second_buses)
+                hub_nursery.cancel_scope.cancel()
+
+            os.remove(socket_path)
+            async with trio.open_nursery() as hub_nursery:
+                await hub_nursery.start(serve_hub, socket_path)
+                bus = {'busId': 'a134aa', 'lat': 55.7, 'lng': 37.5, 'route': '670к'}
+                await publish_until_received(second_send_channel, bus, first_buses)
+                hub_nursery.cancel_scope.cancel()
+            nursery.cancel_scope.cancel()
+
+    trio.run(exchange_through_restarted_hub, strict_exception_groups=True)
+
+
+def test_fleet_advances_all_buses():
+    route = Route(name='1', points=memoryview(array('d', [55.0, 37.0, 55.1, 37.1, 55.2, 37.2])))
+    fleet = Fleet()
+    fleet.add_route(route, 'e1', 3)
+    fleet.cursors[0], fleet.directions[0] = 2, 1
+
+    buses = fleet.advance()
+    assert [bus['busId'] for bus in buses] == ['e1-0', 'e1-1', 'e1-2']
+    assert buses[0] == {'busId': 'e1-0', 'lat': 55.2, 'lng': 37.2, 'route': 'e1'}
+    assert (fleet.cursors[0], fleet.directions[0]) == (2, -1)
+    assert fleet.advance()[0]['lat'] == 55.2
+    assert fleet.advance()[0]['lat'] == 55.1
+
+
+def test_build_binary_messages():
+    session = BrowserSession(is_binary=True)
+    bus_indexes = BusIndexes()
+    first_bus = Bus(busId='c790сс', lat=55.75, lng=37.6, route='120')
+    second_bus = Bus(busId='a134aa', lat=55.7494, lng=37.621, route='670к')
+
+    dictionary, buses = build_binary_messages(session, make_viewport([first_bus, second_bus]), bus_indexes)
+    assert unpack_from('<B3xI', dictionary) == (1, 2)
+    assert loads(dictionary[8:].decode()) == [[0, 'c790сс', '120'], [1, 'a134aa', '670к']]
+    assert unpack_from('<B3xI', buses) == (2, 2)
+    assert unpack_from('<2I', buses, 8) == (0, 1)
+    assert unpack_from('<4f', buses, 16) == pytest.approx((55.75, 37.6, 55.7494, 37.621))
+
+    (buses,) = build_binary_messages(session, make_viewport([second_bus]), bus_indexes)
+    assert unpack_from('<B3xII', buses) == (2, 1, 1)
+
+    bus_indexes.discard('c790сс')
+    third_bus = Bus(busId='o001oo', lat=55.76, lng=37.62, route='120')
+    dictionary, buses = build_binary_messages(session, make_viewport([third_bus]), bus_indexes)
+    assert loads(dictionary[8:].decode()) == [[0, 'o001oo', '120']]
+    assert unpack_from('<B3xII', buses) == (2, 1, 0)
+
+
+def test_binary_session_dictionary_is_reset_past_limit(monkeypatch):
+    monkeypatch.setattr(consts, 'BUS_DICTIONARY_MAX_SIZE', 4)
+    session = BrowserSession(is_binary=True)
+    bus_indexes = BusIndexes()
+    for bus_number in range(10):
+        bus = Bus(busId=str(bus_number), lat=55.75, lng=37.6, route='1')
+        build_binary_messages(session, make_viewport([bus]), bus_indexes)
+        assert len(session.bus_dictionary) <= 5
+
+    bus = Bus(busId='9', lat=55.75, lng=37.6, route='1')
+    session.bus_dictionary = {bus_index: str(bus_index) for bus_index in range(5, 10)}
+    dictionary, _ = build_binary_messages(session, make_viewport([bus]), bus_indexes)
+    assert loads(dictionary[8:].decode()) == [[9, '9', '1']]
+    assert session.bus_dictionary == {9: '9'}
+
+
+def test_binary_buses_message_is_shared_by_viewport():
+    bus_indexes = BusIndexes()
+    bus_indexes.get('a134aa')
+    viewport = make_viewport([Bus(busId='c790сс', lat=55.75, lng=37.6, route='120')])
+    first_session, second_session = BrowserSession(is_binary=True), BrowserSession(is_binary=True)
+
+    first_dictionary, first_buses = prepare_buses_messages(first_session, viewport, BusesFragments(), bus_indexes)
+    second_dictionary, second_buses = prepare_buses_messages(second_session, viewport, BusesFragments(), bus_indexes)
+    assert first_buses is second_buses
+    assert first_dictionary == second_dictionary
+    assert loads(first_dictionary[8:].decode()) == [[1, 'c790сс', '120']]
+    assert prepare_buses_messages(first_session, viewport, BusesFragments(), bus_indexes) == [first_buses]
+
+
+@pytest.mark.parametrize('payload, expected', [
+    (
+        '{"msgType": "Buses", "buses": {"busId": "c790сс", "lat": 55.75, "lng": 37, "route": "120"}}',
+        {'msgType': 'Buses', 'buses': {'busId': 'c790сс', 'lat': 55.75, 'lng': 37, 'route': '120'}},
+    ),
+    (
+        '{"msgType": "newBounds", "data": {"south_lat": 55.7, "north_lat": 55.8, "west_lng": 37, "east_lng": 37.7}}',
+        {'south_lat': 55.7, 'north_lat': 55.8, 'west_lng': 37, 'east_lng': 37.7},
+    ),
+    ('[1, 2]', MessageErrors.NO_MSG_TYPE),
+    (
+        '{"msgType": "Buses", "buses": [{"busId": "c790сс", "lat": "55.75", "lng": 37.6, "route": "120"}]}',
+        MessageErrors.INVALID_BUSES,
+    ),
+    (
+        '{"msgType": "Buses", "buses": [{"busId": "c790сс", "lat": true, "lng": 37.6, "route": "120"}]}',
+        MessageErrors.INVALID_BUSES,
+    ),
+    ('{"msgType": "Buses", "buses": [{"busId": "c790сс", "lat": 55.75, "lng": 37.6}]}', MessageErrors.INVALID_BUSES),
+    ('{"msgType": "Buses"}', MessageErrors.INVALID_BUSES),
+    (
+        '{"msgType": "newBounds", "data": {"south_lat": 55.7, "north_lat": 55.8, "west_lng": 37}}',
+        MessageErrors.INVALID_BOUNDS,
+    ),
+])
+def test_json_message_validator(payload, expected):
+    validated_data = JsonMessageValidator(message=payload).get_validated_data()
+    if isinstance(expected, MessageErrors):
+        assert validated_data.error == expected
+    else:
+        assert validated_data == expected
+
+
+@pytest.mark.parametrize('lat, lng, is_valid', [
+    (55.75, 37.6, True),
+    (-90, 180, True),
+    (90.5, 37.6, False),
+    (55.75, -1e308, False),
+    (float('nan'), 37.6, False),
+    (55.75, float('inf'), False),
+])
+def test_matches_schema_rejects_out_of_range_coordinates(lat, lng, is_valid):
+    bus = {'busId': 'c790сс', 'lat': lat, 'lng': lng, 'route': '120'}
+    assert matches_schema(bus, BUS_SCHEMA, BUS_RANGES) is is_valid
+
+
+@pytest.mark.trio
+async def test_browser_client_survives_huge_bounds(browser_bus_client):
+    bounds = {'south_lat': -1e308, 'north_lat': 1e308, 'west_lng': -1e308, 'east_lng': 1e308}
+    await browser_bus_client.send_message(dumps({'msgType': 'newBounds', 'data': bounds}))
+    for _ in range(ERROR_MESSAGE_RETRY_AMOUNT):
+        assert loads(await browser_bus_client.get_message())['msgType'] == 'Buses'
+
+
+@pytest.mark.parametrize('value', [float('nan'), float('inf'), -float('inf')])
+def test_matches_schema_rejects_non_finite_bounds(value):
+    bounds = {'south_lat': 55.7, 'north_lat': 55.8, 'west_lng': 37.5, 'east_lng': value}
+    assert not matches_schema(bounds, BOUNDS_SCHEMA, BOUNDS_RANGES)
+
+
+def test_viewport_cache_clamps_huge_bounds():
+    registered_buses = BusesStorage()
+    registered_buses.update(Bus(busId='1', lat=55.755, lng=37.605, route='1'))
+    bounds = WindowBounds()
+    bounds.update(south_lat=-1e308, north_lat=1e308, west_lng=-200, east_lng=1e308)
+    assert (bounds.south_lat, bounds.north_lat, bounds.west_lng, bounds.east_lng) == (-90, 90, -180, 180)
+    assert list(registered_buses.find_viewport(bounds, now=10).buses) == ['1']
+
+
+def test_adapt_update_timeout_to_slow_browser():
+    session = BrowserSession(update_timeout=0.25)
+    for _ in range(10):
+        adapt_update_timeout(session, send_time=3, base_timeout=0.25, max_timeout=4)
+    assert session.update_timeout == 4
+
+    for _ in range(100):
+        adapt_update_timeout(session, send_time=0.001, base_timeout=0.25, max_timeout=4)
+    assert session.update_timeout == 0.25
+
+
+def test_schedule_next_update_skips_missed_frames():
+    session = BrowserSession(update_timeout=0.25)
+    assert schedule_next_update(session, deadline=10, now=10.1) == 10.25
+    assert session.skipped_frames == 0
+    assert schedule_next_update(session, deadline=10, now=10.6) == 10.75
+    assert session.skipped_frames == 2
+
+
+def test_viewport_cache_groups_near_identical_bounds():
+    registered_buses = BusesStorage(viewports=ViewportCache(ttl=0.25, quantum=0.01))
+    registered_buses.update(Bus(busId='1', lat=55.755, lng=37.605, route='1'))
+    registered_buses.update(Bus(busId='2', lat=55.795, lng=37.605, route='1'))
+    first_bounds = WindowBounds(south_lat=55.751, north_lat=55.789, west_lng=37.601, east_lng=37.609)
+    second_bounds = WindowBounds(south_lat=55.752, north_lat=55.788, west_lng=37.602, east_lng=37.608)
+
+    viewport = registered_buses.find_viewport(first_bounds, now=10)
+    assert list(viewport.buses) == ['1']
+    assert registered_buses.find_viewport(second_bounds, now=10.2) is viewport
+    assert viewport.get_snapshot(registered_buses.fragments) is viewport.get_snapshot(registered_buses.fragments)
+
+    assert registered_buses.find_viewport(second_bounds, now=10.3) is not viewport
+    assert registered_buses.find_viewport(WindowBounds(south_lat=55.7, north_lat=55.8), now=10.6).buses == {}
+    assert len(registered_buses.viewports.viewports) == 1
+
+
+@pytest.mark.trio
+async def test_track_recorder_writes_time_ordered_records(tmp_path):
+    first_recorder = TrackRecorder(tracks_dir=str(tmp_path), writer_id=1)
+    second_recorder = TrackRecorder(tracks_dir=str(tmp_path), writer_id=2, buffer_max_size=1)
+    bus = {'busId': 'c790сс', 'lat': 55.75, 'lng': 37.6, 'route': '120'}
+    first_recorder.record([bus], timestamp=1000.0)
+    first_recorder.record([bus], timestamp=1002.0)
+    second_recorder.record([bus], timestamp=1001.0)
+    second_recorder.record([bus], timestamp=1003.0)
+    await first_recorder.flush()
+    await second_recorder.flush()
+
+    (day,) = [path.name for path in tmp_path.iterdir()]
+    assert list(read_tracks(str(tmp_path), day)) == [(1000.0, [bus]), (1001.0, [bus]), (1002.0, [bus])]
+
+
+def test_metrics_render_prometheus_text():
+    histogram = Histogram(name='send_seconds', description='Send time.', buckets=(0.1, 1))
+    for value in (0.05, 0.1, 0.5, 3):
+        histogram.observe(value)
+    assert histogram.render()[2:] == [
+        'send_seconds_bucket{le="0.1"} 2',
+        'send_seconds_bucket{le="1"} 3',
+        'send_seconds_bucket{le="+Inf"} 4',
+        'send_seconds_sum 3.65',
+        'send_seconds_count 4',
+    ]
+
+    metrics = ServerMetrics()
+    metrics.ingest_buses.inc(3)
+    metrics.browsers_connected.inc()
+    text = metrics.render()
+    assert 'tracker_ingest_buses_total 3\n' in text
+    assert '# TYPE tracker_browsers_connected gauge\ntracker_browsers_connected 1\n' in text
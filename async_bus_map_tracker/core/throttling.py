@@ -0,0 +1,49 @@
+from math import floor
+
+from async_bus_map_tracker.core import consts
+from async_bus_map_tracker.core.models import BrowserSession
+
+
+def adapt_update_timeout(
+    session: BrowserSession,
+    send_time: float,
+    base_timeout: float,
+    max_timeout: float = consts.MAX_BUSES_UPDATE_TIMEOUT,
+) -> float:
+    """Adjust browser update interval to its measured send latency.
+
+    A websocket send waits until the connection stream accepts the frame, so the latency grows with the bytes
+    buffered for a slow client. The interval is doubled while sends take a noticeable part of it and shrinks back
+    to the base one when the client keeps up again.
+
+    Args:
+        session: mutable argument as BrowserSession instance;
+        send_time: seconds spent sending the last update;
+        base_timeout: server update interval in seconds;
+        max_timeout: the slowest allowed update interval in seconds.
+    """
+    update_timeout = session.update_timeout or base_timeout
+    smoothing = consts.SEND_LATENCY_SMOOTHING
+    session.send_latency = smoothing * send_time + (1 - smoothing) * session.send_latency
+    if session.send_latency > update_timeout * consts.SLOW_SEND_RATIO:
+        update_timeout = min(update_timeout * 2, max_timeout)
+    elif session.send_latency < update_timeout * consts.FAST_SEND_RATIO:
+        update_timeout = max(update_timeout * 0.75, base_timeout)
+    session.update_timeout = update_timeout
+    return update_timeout
+
+
+def schedule_next_update(session: BrowserSession, deadline: float, now: float) -> float:
+    """Return the next update deadline, skipping frames missed while the previous update was sent.
+
+    Deadlines are aligned to multiples of the update interval, so browsers with the same interval are updated
+    at the same moments and share viewports computed for the tick.
+
+    Args:
+        session: mutable argument as BrowserSession instance;
+        deadline: deadline of the update just sent;
+        now: current trio time.
+    """
+    next_deadline = (floor(now / session.update_timeout) + 1) * session.update_timeout
+    session.skipped_frames += max(round((next_deadline - deadline) / session.update_timeout) - 1, 0)
+    return next_deadline
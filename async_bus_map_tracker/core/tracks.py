@@ -0,0 +1,101 @@
+import heapq
+import json
+import logging
+import os
+import time
+from collections.abc import Iterator
+from dataclasses import dataclass, field
+from datetime import datetime
+
+import trio
+
+from async_bus_map_tracker.core import consts
+
+logger = logging.getLogger()
+
+TrackRecord = tuple[float, list[dict]]
+
+
+def get_track_path(tracks_dir: str, timestamp: float, writer_id: int) -> str:
+    """Return path of the track file for an hour: tracks_dir/YYYY-MM-DD/HH.<writer_id>.jsonl.
+
+    Every server worker appends to its own files, so no locks are needed between processes.
+    """
+    moment = datetime.fromtimestamp(timestamp)
+    return os.path.join(tracks_dir, moment.strftime('%Y-%m-%d'), f'{moment:%H}.{writer_id}.jsonl')
+
+
+def write_track_lines(lines_by_path: dict[str, list[str]]) -> None:
+    for path, lines in lines_by_path.items():
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'a', encoding='utf8') as file:
+            file.writelines(lines)
+
+
+@dataclass(kw_only=True, slots=True)
+class TrackRecorder:
+    """Buffer of received bus positions appended to hourly track files in batches from a worker thread.
+
+    Each line of a track file is a JSON list [timestamp, buses] with buses of one received message.
+    """
+
+    tracks_dir: str
+    writer_id: int = field(default_factory=os.getpid)
+    buffer_max_size: int = consts.TRACKS_BUFFER_MAX_SIZE
+    lines_by_path: dict[str, list[str]] = field(default_factory=dict)
+    buffered_lines: int = 0
+    dropped_lines: int = 0
+
+    def record(self, buses: list[dict], timestamp: float | None = None) -> None:
+        if self.buffered_lines >= self.buffer_max_size:
+            self.dropped_lines += 1
+            return
+        timestamp = time.time() if timestamp is None else timestamp
+        path = get_track_path(self.tracks_dir, timestamp, self.writer_id)
+        self.lines_by_path.setdefault(path, []).append(f'{json.dumps([round(timestamp, 3), buses])}\n')
+        self.buffered_lines += 1
+
+    async def flush(self) -> None:
+        lines_by_path, self.lines_by_path, self.buffered_lines = self.lines_by_path, {}, 0
+        if self.dropped_lines:
+            logger.warning(f'Track writer can not keep up, {self.dropped_lines} messages are not recorded')
+            self.dropped_lines = 0
+        if lines_by_path:
+            await trio.to_thread.run_sync(write_track_lines, lines_by_path)
+
+
+async def write_tracks(recorder: TrackRecorder, flush_timeout: float) -> None:
+    """Periodically append recorded positions to track files, the rest is written on cancellation.
+
+    Args:
+        recorder: buffer of received bus positions;
+        flush_timeout: periodic timeout in seconds.
+    """
+    try:
+        while True:
+            await trio.sleep(flush_timeout)
+            await recorder.flush()
+    finally:
+        with trio.CancelScope(shield=True):
+            await recorder.flush()
+
+
+def read_track_file(path: str) -> Iterator[TrackRecord]:
+    with open(path, 'r', encoding='utf8') as file:
+        for line in file:
+            timestamp, buses = json.loads(line)
+            yield timestamp, buses
+
+
+def read_tracks(tracks_dir: str, day: str) -> Iterator[TrackRecord]:
+    """Iterate over records of a day from all writers in time order.
+
+    Args:
+        tracks_dir: directory with track files;
+        day: date in YYYY-MM-DD format.
+    """
+    day_dir = os.path.join(tracks_dir, day)
+    filenames = sorted(filename for filename in os.listdir(day_dir) if filename.endswith('.jsonl'))
+    for hour in sorted({filename.split('.', 1)[0] for filename in filenames}):
+        hour_files = [read_track_file(os.path.join(day_dir, name)) for name in filenames if name.startswith(f'{hour}.')]
+        yield from heapq.merge(*hour_files, key=lambda record: record[0])
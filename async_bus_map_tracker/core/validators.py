@@ -1,25 +1,79 @@
 import json
+import sys
 from dataclasses import dataclass
 
-from async_bus_map_tracker.core.models import MessageErrors, MessageTypes, MessageValidationError
+from async_bus_map_tracker.core import consts
+from async_bus_map_tracker.core.models import MESSAGE_TYPES, MessageErrors, MessageTypes, MessageValidationError
+
+try:
+    from orjson import loads
+except ImportError:
+    from json import loads
+
+NUMBER_TYPES = frozenset((int, float))
+STRING_TYPES = frozenset((str,))
+
+FINITE_RANGE = (-sys.float_info.max, sys.float_info.max)
+
+BUS_SCHEMA = {'busId': STRING_TYPES, 'lat': NUMBER_TYPES, 'lng': NUMBER_TYPES, 'route': STRING_TYPES}
+BUS_RANGES = {'lat': consts.LAT_RANGE, 'lng': consts.LNG_RANGE}
+BOUNDS_SCHEMA = {
+    'south_lat': NUMBER_TYPES,
+    'north_lat': NUMBER_TYPES,
+    'west_lng': NUMBER_TYPES,
+    'east_lng': NUMBER_TYPES,
+}
+BOUNDS_RANGES = {field_name: FINITE_RANGE for field_name in BOUNDS_SCHEMA}
+
+
+def matches_schema(
+    data,
+    schema: dict[str, frozenset[type]],
+    ranges: dict[str, tuple[float, float]] | None = None,
+) -> bool:
+    """Check in one pass that data has exactly the schema fields and each value has an allowed type.
+
+    Args:
+        data: decoded JSON value;
+        schema: field names mapped to allowed value types, bool is not accepted as a number;
+        ranges: numeric field names mapped to allowed minimum and maximum, NaN and infinities are out of any range.
+    """
+    if type(data) is not dict or len(data) != len(schema):
+        return False
+    for field_name, value in data.items():
+        allowed_types = schema.get(field_name)
+        if allowed_types is None or type(value) not in allowed_types:
+            return False
+    if ranges:
+        for field_name, (min_value, max_value) in ranges.items():
+            if not min_value <= data[field_name] <= max_value:
+                return False
+    return True
 
 
 @dataclass(frozen=True, kw_only=True, slots=True)
 class JsonMessageValidator:
-    message: str
+    message: str | bytes
+    message_types: frozenset[str] = MESSAGE_TYPES
 
     def get_validated_data(self) -> dict | MessageValidationError:
         try:
-            json_message = json.loads(self.message)
+            json_message = loads(self.message)
         except json.JSONDecodeError:
             return MessageValidationError(error=MessageErrors.INVALID_JSON)
 
-        message_type = json_message.get('msgType')
-        if not (message_type and MessageTypes.exists(message_type)):
+        message_type = json_message.get('msgType') if type(json_message) is dict else None
+        if message_type not in self.message_types:
             return MessageValidationError(error=MessageErrors.NO_MSG_TYPE)
         if message_type == MessageTypes.NEW_BOUNDS.value:
-            if json_message.get('data'):
-                json_message = json_message['data']
-            else:
+            if not json_message.get('data'):
                 return MessageValidationError(error=MessageErrors.NO_DATA_IN_BOUNDS)
+            if not matches_schema(json_message['data'], BOUNDS_SCHEMA, BOUNDS_RANGES):
+                return MessageValidationError(error=MessageErrors.INVALID_BOUNDS)
+            return json_message['data']
+        if message_type == MessageTypes.BUSES.value:
+            buses = json_message.get('buses')
+            buses = buses if type(buses) is list else [buses]
+            if not all(matches_schema(bus, BUS_SCHEMA, BUS_RANGES) for bus in buses):
+                return MessageValidationError(error=MessageErrors.INVALID_BUSES)
         return json_message
@@ -0,0 +1,35 @@
+import multiprocessing
+import os
+import signal
+from collections.abc import Callable, Iterable
+
+from async_bus_map_tracker.core import consts
+
+
+def run_process_target(target: Callable, args: tuple) -> None:
+    """Run worker target interruptible by SIGINT even if the launcher was started with SIGINT ignored."""
+    signal.signal(signal.SIGINT, signal.default_int_handler)
+    target(*args)
+
+
+def start_processes(target: Callable, processes_args: Iterable[tuple]) -> list[multiprocessing.Process]:
+    """Fork daemon worker processes running target with each of processes_args."""
+    processes = [
+        multiprocessing.Process(target=run_process_target, args=(target, args), daemon=True)
+        for args in processes_args
+    ]
+    for process in processes:
+        process.start()
+    return processes
+
+
+def stop_processes(processes: list[multiprocessing.Process], stop_timeout: float = consts.PROCESS_STOP_TIMEOUT) -> None:
+    """Interrupt worker processes and terminate the ones not stopped in stop_timeout seconds."""
+    for process in processes:
+        if process.is_alive():
+            os.kill(process.pid, signal.SIGINT)
+    for process in processes:
+        process.join(stop_timeout)
+        if process.is_alive():
+            process.terminate()
+            process.join()
@@ -1,9 +1,14 @@
 import json
 import logging
+import multiprocessing
+import queue
+import signal
+from collections.abc import Iterable, Iterator
 from contextlib import suppress
-from dataclasses import asdict
-from itertools import chain, cycle, islice
-from random import choice, randint
+from dataclasses import asdict, replace
+from itertools import islice
+from multiprocessing.queues import Queue
+from random import choice
 
 import trio
 from trio_websocket import open_websocket_url
@@ -11,75 +16,216 @@ from trio_websocket import open_websocket_url
 from async_bus_map_tracker.core import consts
 from async_bus_map_tracker.core.config import configure_application
 from async_bus_map_tracker.core.connections import relaunch_on_disconnect
-from async_bus_map_tracker.core.models import Bus, MessageTypes
-from async_bus_map_tracker.core.routes import generate_bus_id, load_routes
+from async_bus_map_tracker.core.models import Bus, ConfigData, MessageTypes, SendStats, SimulatorEngines
+from async_bus_map_tracker.core.routes import generate_bus_id, get_random_cursor, load_routes, move_cursor, Route
+from async_bus_map_tracker.core.simulator import Fleet
+from async_bus_map_tracker.core.workers import start_processes, stop_processes
 
 logger = logging.getLogger()
 logging.basicConfig(level=logging.INFO)
 
 
+async def collect_updates(
+    receive_channel: trio.MemoryReceiveChannel,
+    pending_buses: dict[str, dict],
+    wakeup_channel: trio.MemorySendChannel,
+) -> None:
+    """Keep only the newest position of every bus queued while the previous batch is being sent."""
+    async for buses in receive_channel:
+        for bus in buses:
+            pending_buses[bus['busId']] = bus
+        with suppress(trio.WouldBlock):
+            wakeup_channel.send_nowait(None)
+
+
+def pop_pending_batches(pending_buses: dict[str, dict]) -> list[list[dict]]:
+    """Take all pending positions split into batches of one frame each."""
+    buses = list(pending_buses.values())
+    pending_buses.clear()
+    return [
+        buses[batch_start:batch_start + consts.BUSES_BATCH_MAX_SIZE]
+        for batch_start in range(0, len(buses), consts.BUSES_BATCH_MAX_SIZE)
+    ]
+
+
 @relaunch_on_disconnect
-async def send_updates(server_address: str, receive_channel: trio.MemoryReceiveChannel) -> None:
+async def send_updates(
+    server_address: str,
+    pending_buses: dict[str, dict],
+    wakeup_channel: trio.MemoryReceiveChannel,
+    stats: SendStats,
+) -> None:
+    """Send positions collected by collect_updates, they keep being collected while the connection is reopened."""
     async with open_websocket_url(server_address) as ws:
         logger.info(f'Open ws connection for {server_address}')
-        async with receive_channel:
-            async for value in receive_channel:
-                await ws.send_message(value)
-                logger.info(f'message send {value}')
-                await trio.sleep(consts.SEND_UPDATES_TIMEOUT)
+        async for _ in wakeup_channel:
+            for batch in pop_pending_batches(pending_buses):
+                message = {'msgType': MessageTypes.BUSES.value, 'buses': batch}
+                await ws.send_message(json.dumps(message, ensure_ascii=True))
+                stats.buses += len(batch)
+                stats.frames += 1
+                logger.debug('%s buses send', len(batch))
 
 
 async def run_bus(
     send_channel: trio.MemorySendChannel,
     bus_index: int,
     bus_id: str,
-    coordinates: tuple[float, float],
+    route: Route,
     refresh_timeout: int,
 ) -> None:
-    full_route = list(chain(coordinates, reversed(coordinates)))
-    route = cycle(islice(full_route, randint(0, len(full_route) - 1), None))
+    cursor, direction = get_random_cursor(len(route))
     async with send_channel:
         while True:
-            lat, lng = next(route)
-            message = {
-                'msgType': MessageTypes.BUSES.value,
-                'buses': asdict(Bus(
-                    busId=generate_bus_id(bus_id, bus_index),
-                    lat=lat,
-                    lng=lng,
-                    route=bus_id,
-                )),
-            }
-            await send_channel.send(json.dumps(message, ensure_ascii=True))
+            lat, lng = route.get_point(cursor)
+            cursor, direction = move_cursor(cursor, direction, len(route))
+            bus = asdict(Bus(
+                busId=generate_bus_id(bus_id, bus_index),
+                lat=lat,
+                lng=lng,
+                route=bus_id,
+            ))
+            await send_channel.send([bus])
             await trio.sleep(refresh_timeout)
-            logger.info(f'message send {message}')
+            logger.debug('bus update queued %s', bus)
+
+
+async def run_fleet(send_channel: trio.MemorySendChannel, fleet: Fleet, refresh_timeout: int) -> None:
+    """Advance all buses in one task with a fixed tick rate and queue their positions in batches."""
+    next_tick = trio.current_time()
+    async with send_channel:
+        while True:
+            buses = fleet.advance()
+            for batch_start in range(0, len(buses), consts.BUSES_BATCH_MAX_SIZE):
+                await send_channel.send(buses[batch_start:batch_start + consts.BUSES_BATCH_MAX_SIZE])
+            logger.debug('%s bus updates queued', len(buses))
+            next_tick = max(next_tick + refresh_timeout, trio.current_time())
+            await trio.sleep_until(next_tick)
+
+
+async def report_send_stats(
+    stats: SendStats,
+    shard_index: int,
+    stats_queue: Queue | None,
+    report_timeout: float,
+) -> None:
+    """Log send rate or pass it to the launcher of emulator processes.
+
+    Args:
+        stats: counters of sent buses and frames;
+        shard_index: index of the emulator process;
+        stats_queue: launcher queue, None for single process emulator;
+        report_timeout: periodic timeout in seconds.
+    """
+    while True:
+        await trio.sleep(report_timeout)
+        buses, frames, stats.buses, stats.frames = stats.buses, stats.frames, 0, 0
+        if stats_queue is None:
+            logger.info(f'{buses / report_timeout:.0f} buses/s send in {frames / report_timeout:.1f} frames/s')
+        else:
+            stats_queue.put((shard_index, buses / report_timeout, frames / report_timeout))
+
 
+def get_shard_routes(
+    routes: Iterable[Route],
+    shard_index: int,
+    shards_number: int,
+    routes_number: int,
+) -> Iterator[Route]:
+    """Take every shards_number-th of the first routes_number routes starting from shard_index."""
+    return islice(routes, shard_index, routes_number, max(shards_number, 1))
 
-async def main() -> None:
+
+def limit_processes(config_data: ConfigData, routes_count: int) -> ConfigData:
+    """Cut emulator processes down to the number of emulated routes, so every process gets a route."""
+    processes = max(min(config_data.processes, routes_count), 1)
+    if processes < config_data.processes:
+        logger.warning(f'Only {routes_count} routes to emulate, starting {processes} processes')
+    return replace(config_data, processes=processes)
+
+
+async def run_emulator(
+    config_data: ConfigData,
+    shard_index: int = 0,
+    stats_queue: Queue | None = None,
+) -> None:
+    """Emulate buses of the shard routes: every processes-th of the first routes_number routes from shard_index."""
     with suppress(KeyboardInterrupt):
-        config_data = configure_application()
         send_channel, receive_channel = trio.open_memory_channel(0)
         receiver_clones = [receive_channel.clone() for _ in range(config_data.websockets_number)]
         sender_clones = [send_channel.clone() for _ in range(config_data.websockets_number)]
+        stats = SendStats()
 
         async with trio.open_nursery() as nursery:
             server_address = f'{config_data.server_protocol}{config_data.server_host}:{config_data.server_port}'
             for i in range(config_data.websockets_number):
-                nursery.start_soon(send_updates, server_address, receiver_clones[i])
-
-            routes = list(load_routes())[:config_data.routes_number]
-            for route in routes:
-                for bus_index in range(config_data.buses_per_route):
-                    channel = choice(sender_clones)
-                    nursery.start_soon(
-                        run_bus,
-                        channel,
-                        bus_index,
-                        f"{config_data.emulator_id}{route['name']}",
-                        route['coordinates'],
-                        config_data.refresh_timeout,
-                    )
+                pending_buses = {}
+                wakeup_send_channel, wakeup_receive_channel = trio.open_memory_channel(1)
+                nursery.start_soon(collect_updates, receiver_clones[i], pending_buses, wakeup_send_channel)
+                nursery.start_soon(send_updates, server_address, pending_buses, wakeup_receive_channel, stats)
+            nursery.start_soon(report_send_stats, stats, shard_index, stats_queue, consts.SEND_STATS_TIMEOUT)
+
+            routes = get_shard_routes(load_routes(), shard_index, config_data.processes, config_data.routes_number)
+            if config_data.engine == SimulatorEngines.FLEET.value:
+                fleet = Fleet()
+                for route in routes:
+                    fleet.add_route(route, f'{config_data.emulator_id}{route.name}', config_data.buses_per_route)
+                nursery.start_soon(run_fleet, send_channel, fleet, config_data.refresh_timeout)
+            else:
+                for route in routes:
+                    for bus_index in range(config_data.buses_per_route):
+                        channel = choice(sender_clones)
+                        nursery.start_soon(
+                            run_bus,
+                            channel,
+                            bus_index,
+                            f"{config_data.emulator_id}{route.name}",
+                            route,
+                            config_data.refresh_timeout,
+                        )
+
+
+def run_shard(config_data: ConfigData, shard_index: int, stats_queue: Queue) -> None:
+    with suppress(KeyboardInterrupt):
+        trio.run(run_emulator, config_data, shard_index, stats_queue)
+
+
+def run_shards(config_data: ConfigData) -> None:
+    """Start emulator processes and log their aggregated send rate."""
+    stats_queue = multiprocessing.Queue()
+    processes = start_processes(
+        run_shard,
+        ((config_data, shard_index, stats_queue) for shard_index in range(config_data.processes)),
+    )
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+
+    shard_rates = {}
+    with suppress(KeyboardInterrupt):
+        while any(process.is_alive() for process in processes):
+            try:
+                shard_index, buses_rate, frames_rate = stats_queue.get(timeout=consts.SEND_STATS_TIMEOUT)
+            except queue.Empty:
+                continue
+            shard_rates[shard_index] = buses_rate, frames_rate
+            logger.info(
+                f'shard {shard_index}: {buses_rate:.0f} buses/s, total: '
+                f'{sum(rate for rate, _ in shard_rates.values()):.0f} buses/s '
+                f'in {sum(rate for _, rate in shard_rates.values()):.1f} frames/s',
+            )
+    stop_processes(processes)
+
+
+def main() -> None:
+    config_data = configure_application()
+    if config_data.logging:
+        logger.setLevel(config_data.logging.upper())
+    routes_count = sum(1 for _ in islice(load_routes(), config_data.routes_number))
+    config_data = limit_processes(config_data, routes_count)
+    if config_data.processes > 1:
+        run_shards(config_data)
+    else:
+        trio.run(run_emulator, config_data)
 
 
 if __name__ == '__main__':
-    trio.run(main)
+    main()
@@ -0,0 +1,223 @@
+import argparse
+import json
+import logging
+import os
+import resource
+import signal
+import subprocess
+import sys
+import time
+from dataclasses import dataclass, field
+from functools import partial
+from random import uniform
+from statistics import quantiles
+
+import trio
+from dotenv import load_dotenv
+from trio_websocket import ConnectionClosed, HandshakeError, open_websocket_url
+
+from async_bus_map_tracker.benchmarks import MOSCOW_BOUNDS
+from async_bus_map_tracker.core import consts
+from async_bus_map_tracker.core.models import MessageTypes, WindowBounds
+
+logger = logging.getLogger()
+logging.basicConfig(level=logging.INFO, format='%(message)s')
+load_dotenv()
+
+VIEWPORT_LAT_SIZE, VIEWPORT_LNG_SIZE = 0.05, 0.11
+BUS_STEP = 0.0005
+SERVER_START_TIMEOUT = 10
+
+
+@dataclass(kw_only=True, slots=True)
+class LoadTestStats:
+    """Measurements shared by emulated buses and browsers."""
+
+    sent_positions: dict[str, tuple[float, float, float]] = field(default_factory=dict)
+    sent_buses: int = 0
+    sent_frames: int = 0
+    received_messages: int = 0
+    message_sizes: list[int] = field(default_factory=list)
+    latencies: list[float] = field(default_factory=list)
+
+    def track_bus(self, bus: dict, sent_at: float) -> None:
+        self.sent_positions[bus['busId']] = (bus['lat'], bus['lng'], sent_at)
+
+    def track_browser_buses(self, buses: list[dict], received_at: float) -> None:
+        """Measure latency for positions the browser sees for the first time."""
+        for bus in buses:
+            sent_position = self.sent_positions.get(bus['busId'])
+            if sent_position and sent_position[:2] == (bus['lat'], bus['lng']):
+                self.latencies.append(received_at - sent_position[2])
+                del self.sent_positions[bus['busId']]
+
+
+def get_percentiles(values: list[float]) -> tuple[float, float]:
+    if len(values) < 2:
+        return (values[0], values[0]) if values else (0.0, 0.0)
+    percentiles = quantiles(values, n=100, method='inclusive')
+    return percentiles[49], percentiles[98]
+
+
+def get_random_viewport() -> WindowBounds:
+    south_lat = uniform(MOSCOW_BOUNDS.south_lat, MOSCOW_BOUNDS.north_lat - VIEWPORT_LAT_SIZE)
+    west_lng = uniform(MOSCOW_BOUNDS.west_lng, MOSCOW_BOUNDS.east_lng - VIEWPORT_LNG_SIZE)
+    return WindowBounds(
+        south_lat=south_lat,
+        north_lat=south_lat + VIEWPORT_LAT_SIZE,
+        west_lng=west_lng,
+        east_lng=west_lng + VIEWPORT_LNG_SIZE,
+    )
+
+
+async def emulate_buses(server_address: str, bus_ids: list[str], refresh_timeout: float, stats: LoadTestStats) -> None:
+    """Send positions of buses moving randomly around Moscow as batched messages over one websocket."""
+    positions = {
+        bus_id: [uniform(MOSCOW_BOUNDS.south_lat, MOSCOW_BOUNDS.north_lat),
+                 uniform(MOSCOW_BOUNDS.west_lng, MOSCOW_BOUNDS.east_lng)]
+        for bus_id in bus_ids
+    }
+    async with open_websocket_url(server_address) as ws:
+        while True:
+            buses = []
+            for bus_id, position in positions.items():
+                position[0] += uniform(-BUS_STEP, BUS_STEP)
+                position[1] += uniform(-BUS_STEP, BUS_STEP)
+                buses.append({'busId': bus_id, 'lat': position[0], 'lng': position[1], 'route': 'load'})
+            for batch_start in range(0, len(buses), consts.BUSES_BATCH_MAX_SIZE):
+                batch = buses[batch_start:batch_start + consts.BUSES_BATCH_MAX_SIZE]
+                sent_at = time.monotonic()
+                await ws.send_message(json.dumps({'msgType': MessageTypes.BUSES.value, 'buses': batch}))
+                for bus in batch:
+                    stats.track_bus(bus, sent_at)
+                stats.sent_buses += len(batch)
+                stats.sent_frames += 1
+            await trio.sleep(refresh_timeout)
+
+
+async def emulate_browser(
+    server_address: str,
+    is_delta: bool,
+    bounds_timeout: float,
+    stats: LoadTestStats,
+) -> None:
+    """Send random viewport bounds and read bus updates like the map page does."""
+    subprotocols = [consts.DELTA_SUBPROTOCOL] if is_delta else None
+    async with open_websocket_url(server_address, subprotocols=subprotocols) as ws:
+        next_bounds_time = 0.0
+        while True:
+            if time.monotonic() >= next_bounds_time:
+                bounds = get_random_viewport()
+                data = {
+                    'south_lat': bounds.south_lat,
+                    'north_lat': bounds.north_lat,
+                    'west_lng': bounds.west_lng,
+                    'east_lng': bounds.east_lng,
+                }
+                await ws.send_message(json.dumps({'msgType': MessageTypes.NEW_BOUNDS.value, 'data': data}))
+                next_bounds_time = time.monotonic() + bounds_timeout
+
+            message = await ws.get_message()
+            received_at = time.monotonic()
+            stats.received_messages += 1
+            stats.message_sizes.append(len(message))
+            json_message = json.loads(message)
+            if json_message['msgType'] == MessageTypes.BUSES.value:
+                stats.track_browser_buses(json_message['buses'], received_at)
+            elif json_message['msgType'] == MessageTypes.BUSES_DELTA.value:
+                stats.track_browser_buses(json_message['added'] + json_message['moved'], received_at)
+
+
+async def wait_server(server_address: str) -> None:
+    with trio.fail_after(SERVER_START_TIMEOUT):
+        while True:
+            try:
+                async with open_websocket_url(server_address):
+                    return
+            except HandshakeError:
+                await trio.sleep(0.1)
+
+
+def report(stats: LoadTestStats, duration: float, server_cpu_time: float | None) -> None:
+    latency_p50, latency_p99 = get_percentiles(stats.latencies)
+    size_p50, size_p99 = get_percentiles(stats.message_sizes)
+    logger.info(f'ingest: {stats.sent_buses / duration:.0f} buses/s in {stats.sent_frames / duration:.1f} frames/s')
+    logger.info(
+        f'browsers: {stats.received_messages / duration:.1f} msgs/s, '
+        f'{sum(stats.message_sizes) / duration / 1024:.1f} KiB/s',
+    )
+    logger.info(
+        f'message size: p50 {size_p50:.0f} B, p99 {size_p99:.0f} B, max {max(stats.message_sizes, default=0)} B',
+    )
+    logger.info(
+        f'position latency: p50 {latency_p50 * 1000:.1f} ms, p99 {latency_p99 * 1000:.1f} ms '
+        f'({len(stats.latencies)} samples)',
+    )
+    if server_cpu_time is not None:
+        logger.info(f'server cpu: {server_cpu_time:.2f} s, {server_cpu_time / duration * 100:.0f}% of one core')
+
+
+async def run_load_test(args: argparse.Namespace) -> None:
+    bus_address = f'ws://{args.host}:{args.bus_port}'
+    browser_address = f'ws://{args.host}:{args.browser_port}'
+    stats = LoadTestStats()
+    async with trio.open_nursery() as nursery:
+        server_process = None
+        if not args.external_server:
+            server_process = await nursery.start(partial(
+                trio.run_process,
+                [
+                    sys.executable, '-m', 'async_bus_map_tracker.server',
+                    '-sh', args.host, '-sp', str(args.bus_port), '-bp', str(args.browser_port),
+                    '-rn', '1', '-bpr', '1', '-ws_n', '1', '-rt', '1',
+                ],
+                stdout=subprocess.DEVNULL,
+                stderr=subprocess.DEVNULL,
+                check=False,
+            ))
+        await wait_server(bus_address)
+
+        async with trio.open_nursery() as load_nursery:
+            for websocket_index in range(args.websockets_number):
+                bus_ids = [
+                    f'load-{bus_index}' for bus_index in range(websocket_index, args.buses, args.websockets_number)
+                ]
+                load_nursery.start_soon(emulate_buses, bus_address, bus_ids, args.refresh_timeout, stats)
+            for _ in range(args.browsers):
+                load_nursery.start_soon(emulate_browser, browser_address, args.delta, args.bounds_timeout, stats)
+            await trio.sleep(args.duration)
+            load_nursery.cancel_scope.cancel()
+
+        if server_process is not None:
+            server_process.send_signal(signal.SIGINT)
+            await server_process.wait()
+    server_cpu = resource.getrusage(resource.RUSAGE_CHILDREN)
+    report(stats, args.duration, None if args.external_server else server_cpu.ru_utime + server_cpu.ru_stime)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='load test of the bus tracker server')
+    parser.add_argument('-b', '--buses', type=int, default=1000, help='emulated buses amount')
+    parser.add_argument('-c', '--browsers', type=int, default=10, help='emulated browsers amount')
+    parser.add_argument('-d', '--duration', type=float, default=10, help='test duration in seconds')
+    parser.add_argument('-rt', '--refresh_timeout', type=float, default=1, help='bus coordinates refresh timeout')
+    parser.add_argument('-ws_n', '--websockets_number', type=int, default=5, help='websockets for buses')
+    parser.add_argument('-bt', '--bounds_timeout', type=float, default=5, help='browser viewport change timeout')
+    parser.add_argument('--delta', action='store_true', help='browsers use the delta subprotocol')
+    parser.add_argument('-sh', '--host', default=os.getenv('SERVER_HOST', '127.0.0.1'), help='server host')
+    parser.add_argument(
+        '-sp', '--bus_port', type=int, default=os.getenv('BUS_PORT', '8001'), help='server port for buses',
+    )
+    parser.add_argument(
+        '-bp', '--browser_port', type=int, default=os.getenv('BROWSER_PORT', '8080'), help='server port for browsers',
+    )
+    parser.add_argument('--external_server', action='store_true', help='do not start the server, use a running one')
+    args = parser.parse_args()
+    try:
+        trio.run(run_load_test, args)
+    except ConnectionClosed as exc:
+        logger.error(f'Server closed connection {exc}')
+
+
+if __name__ == '__main__':
+    main()
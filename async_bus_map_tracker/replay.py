@@ -0,0 +1,79 @@
+import argparse
+import json
+import logging
+import os
+from collections.abc import Iterable
+
+import trio
+from dotenv import load_dotenv
+from trio_websocket import open_websocket_url
+
+from async_bus_map_tracker.core import consts
+from async_bus_map_tracker.core.models import MessageTypes
+from async_bus_map_tracker.core.tracks import read_tracks, TrackRecord
+
+logger = logging.getLogger()
+logging.basicConfig(level=logging.INFO, format='%(message)s')
+load_dotenv()
+
+
+async def send_pending_buses(ws, pending_buses: dict[str, dict]) -> int:
+    buses = list(pending_buses.values())
+    pending_buses.clear()
+    for batch_start in range(0, len(buses), consts.BUSES_BATCH_MAX_SIZE):
+        batch = buses[batch_start:batch_start + consts.BUSES_BATCH_MAX_SIZE]
+        await ws.send_message(json.dumps({'msgType': MessageTypes.BUSES.value, 'buses': batch}, ensure_ascii=True))
+    return len(buses)
+
+
+async def replay_tracks(server_address: str, records: Iterable[TrackRecord], speed: float) -> None:
+    """Send recorded bus positions to the server keeping their original pace accelerated speed times.
+
+    Positions of records due at the same moment are coalesced by bus and sent in batches, like fake_bus does.
+
+    Args:
+        server_address: websocket address of the server port for buses;
+        records: track records in time order;
+        speed: replay speed factor.
+    """
+    pending_buses = {}
+    sent_buses = 0
+    first_timestamp = None
+    async with open_websocket_url(server_address) as ws:
+        started_at = trio.current_time()
+        for timestamp, buses in records:
+            if first_timestamp is None:
+                first_timestamp = timestamp
+            send_at = started_at + (timestamp - first_timestamp) / speed
+            if send_at > trio.current_time() or len(pending_buses) >= consts.BUSES_BATCH_MAX_SIZE:
+                sent_buses += await send_pending_buses(ws, pending_buses)
+                await trio.sleep_until(send_at)
+            for bus in buses:
+                pending_buses[bus['busId']] = bus
+        sent_buses += await send_pending_buses(ws, pending_buses)
+    elapsed = trio.current_time() - started_at
+    logger.info(
+        f'{sent_buses} bus positions replayed in {elapsed:.1f} s, {sent_buses / max(elapsed, 1e-9):.0f} buses/s',
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='replay recorded bus tracks to the bus tracker server')
+    parser.add_argument('day', help='recorded day in YYYY-MM-DD format')
+    parser.add_argument(
+        '-td', '--tracks_dir', default=os.getenv('TRACKS_DIR') or 'tracks', help='directory with recorded tracks',
+    )
+    parser.add_argument('-s', '--speed', type=float, default=1, help='replay speed factor')
+    parser.add_argument('-sh', '--host', default=os.getenv('SERVER_HOST', '127.0.0.1'), help='server host')
+    parser.add_argument(
+        '-sp', '--bus_port', type=int, default=os.getenv('BUS_PORT', '8001'), help='server port for buses',
+    )
+    args = parser.parse_args()
+    try:
+        trio.run(replay_tracks, f'ws://{args.host}:{args.bus_port}', read_tracks(args.tracks_dir, args.day), args.speed)
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
@@ -1,45 +1,69 @@
 import logging
+import os
+import tempfile
+import time
 from contextlib import suppress
-from dataclasses import asdict
 from functools import partial
-from json import dumps
-from typing import Any
 
 import trio
 from trio_websocket import ConnectionClosed, serve_websocket, WebSocketConnection, WebSocketRequest
 
 from async_bus_map_tracker.core import consts
+from async_bus_map_tracker.core.broadcast import prepare_buses_messages
 from async_bus_map_tracker.core.config import configure_application
-from async_bus_map_tracker.core.models import Bus, MessageTypes, MessageValidationError, WindowBounds
+from async_bus_map_tracker.core.connections import serve_websocket_reuse_port
+from async_bus_map_tracker.core.metrics import serve_metrics, ServerMetrics
+from async_bus_map_tracker.core.models import (
+    BROWSER_MESSAGE_TYPES,
+    BrowserSession,
+    Bus,
+    BUS_MESSAGE_TYPES,
+    ConfigData,
+    MessageValidationError,
+)
+from async_bus_map_tracker.core.pubsub import exchange_buses, publish_buses, run_hub
+from async_bus_map_tracker.core.storage import BusesStorage
+from async_bus_map_tracker.core.throttling import adapt_update_timeout, schedule_next_update
+from async_bus_map_tracker.core.tracks import TrackRecorder, write_tracks
 from async_bus_map_tracker.core.validators import JsonMessageValidator
+from async_bus_map_tracker.core.workers import start_processes, stop_processes
 
 logger = logging.getLogger()
 logging.basicConfig(level=logging.INFO)
 
+metrics = ServerMetrics()
 
-async def send_buses(ws: WebSocketConnection, bounds: WindowBounds, registered_buses: dict[str, Any]) -> None:
-    """Send buses to websocket.
+
+async def send_buses(ws: WebSocketConnection, session: BrowserSession, registered_buses: BusesStorage) -> float:
+    """Send buses to websocket and return seconds spent waiting for the connection to accept them.
 
     Args:
         ws: WebSocketConnection instance;
         registered_buses: all busses data from clients;
-        bounds: mutable argument as WindowBounds instance.
+        session: mutable argument as BrowserSession instance.
     """
-    bounds_buses = {}
-    for bus_id, bus in registered_buses.items():
-        if bounds.is_inside(bus.lat, bus.lng):
-            bounds_buses[bus_id] = asdict(bus)
-    logger.info(f'{len(bounds_buses)} buses inside bounds')
-    message = dumps({'msgType': MessageTypes.BUSES.value, 'buses': list(bounds_buses.values())})
-    await ws.send_message(message)
+    viewport = registered_buses.find_viewport(session.bounds)
+    encode_started_at = time.perf_counter()
+    messages = prepare_buses_messages(session, viewport, registered_buses.fragments, registered_buses.bus_indexes)
+    metrics.encode_seconds.observe(time.perf_counter() - encode_started_at)
+    metrics.broadcast_buses.observe(len(viewport.buses))
+    if metrics.broadcast_buses.count % consts.LOG_SAMPLE_RATE == 0:
+        logger.debug('%s buses inside bounds', len(viewport.buses))
+
+    started_at = trio.current_time()
+    for message in messages:
+        await ws.send_message(message)
+    send_time = trio.current_time() - started_at
+    metrics.send_seconds.observe(send_time)
+    return send_time
 
 
-async def listen_browser(ws: WebSocketConnection, bounds: WindowBounds, registered_buses: dict[str, Any]) -> None:
+async def listen_browser(ws: WebSocketConnection, session: BrowserSession, registered_buses: BusesStorage) -> None:
     """Listen browser websocket .
 
     Args:
         ws: WebSocketConnection instance;
-        bounds: mutable argument as WindowBounds instance.
+        session: mutable argument as BrowserSession instance.
     """
     while True:
         try:
@@ -48,77 +72,190 @@ async def listen_browser(ws: WebSocketConnection, bounds: WindowBounds, register
             logger.error(f'ConnectionClosed {exc}')
             break
         else:
-            logger.info(f'received message {message}')
+            logger.debug('received message %s', message)
 
         if not message:
             continue
-        json_message = JsonMessageValidator(message=message).get_validated_data()
+        json_message = JsonMessageValidator(
+            message=message,
+            message_types=BROWSER_MESSAGE_TYPES,
+        ).get_validated_data()
         if isinstance(json_message, MessageValidationError):
+            metrics.invalid_messages.inc()
             await ws.send_message(str(json_message))
             continue
-        bounds.update(**json_message)
-        await send_buses(ws, bounds, registered_buses)
+        session.bounds.update(**json_message)
+        session.needs_snapshot = True
+        await send_buses(ws, session, registered_buses)
 
 
 async def periodic_send_buses(
     ws: WebSocketConnection,
-    bounds: WindowBounds,
+    session: BrowserSession,
     update_timeout: float,
-    registered_buses: dict[str, Any],
+    registered_buses: BusesStorage,
 ) -> None:
-    """Send buses specified amount of seconds.
+    """Send buses periodically, slowing down and skipping frames for browsers that can't keep up.
 
     Args:
         ws: WebSocketConnection instance;
-        update_timeout: periodic timeout in seconds;
+        update_timeout: base periodic timeout in seconds;
         registered_buses: all busses data from clients;
-        bounds: mutable argument as WindowBounds instance.
+        session: mutable argument as BrowserSession instance.
     """
+    session.update_timeout = update_timeout
+    deadline = trio.current_time()
     while True:
-        await send_buses(ws, bounds, registered_buses)
-        await trio.sleep(update_timeout)
+        try:
+            with trio.fail_after(consts.BROWSER_SEND_TIMEOUT):
+                send_time = await send_buses(ws, session, registered_buses)
+        except ConnectionClosed:
+            break
+        except trio.TooSlowError:
+            logger.warning(f'Browser did not accept buses for {consts.BROWSER_SEND_TIMEOUT} seconds, disconnecting')
+            break
+        previous_timeout = session.update_timeout
+        adapt_update_timeout(session, send_time, update_timeout)
+        if session.update_timeout != previous_timeout:
+            logger.debug(f'Browser update timeout changed to {session.update_timeout:.2f} s')
+        skipped_frames = session.skipped_frames
+        deadline = schedule_next_update(session, deadline, trio.current_time())
+        metrics.skipped_frames.inc(session.skipped_frames - skipped_frames)
+        await trio.sleep_until(deadline)
 
 
-async def talk_to_browser(request: WebSocketRequest, update_timeout: float, registered_buses: dict[str, Any]) -> None:
-    ws = await request.accept()
-    bounds = WindowBounds()
-    async with trio.open_nursery() as nursery:
-        nursery.start_soon(listen_browser, ws, bounds, registered_buses)
-        nursery.start_soon(periodic_send_buses, ws, bounds, update_timeout, registered_buses)
+async def talk_to_browser(request: WebSocketRequest, update_timeout: float, registered_buses: BusesStorage) -> None:
+    subprotocol = next(
+        (subprotocol for subprotocol in request.proposed_subprotocols if subprotocol in consts.BROWSER_SUBPROTOCOLS),
+        None,
+    )
+    ws = await request.accept(subprotocol=subprotocol)
+    session = BrowserSession(
+        is_delta=subprotocol == consts.DELTA_SUBPROTOCOL,
+        is_binary=subprotocol == consts.BINARY_SUBPROTOCOL,
+    )
+    metrics.browsers_connected.inc()
+    try:
+        async with trio.open_nursery() as nursery:
+            nursery.start_soon(listen_browser, ws, session, registered_buses)
+            await periodic_send_buses(ws, session, update_timeout, registered_buses)
+            nursery.cancel_scope.cancel()
+    finally:
+        metrics.browsers_connected.dec()
 
 
-async def get_bus_messages(request: WebSocketRequest, registered_buses: dict[str, Any]) -> None:
+async def get_bus_messages(
+    request: WebSocketRequest,
+    registered_buses: BusesStorage,
+    publish_channel: trio.MemorySendChannel | None = None,
+    recorder: TrackRecorder | None = None,
+) -> None:
     ws = await request.accept()
     while True:
         try:
             message = await ws.get_message()
-            json_message = JsonMessageValidator(message=message).get_validated_data()
+            metrics.ingest_messages.inc()
+            json_message = JsonMessageValidator(
+                message=message,
+                message_types=BUS_MESSAGE_TYPES,
+            ).get_validated_data()
             if isinstance(json_message, MessageValidationError):
+                metrics.invalid_messages.inc()
                 await ws.send_message(str(json_message))
                 continue
 
-            if json_message['msgType'] == MessageTypes.BUSES.value:
-                registered_buses[json_message['buses']['busId']] = Bus(**json_message['buses'])
-            logger.info(f'message received: {message}')
+            buses = json_message['buses']
+            buses = buses if isinstance(buses, list) else [buses]
+            for bus in buses:
+                registered_buses.update(Bus(**bus))
+            metrics.ingest_buses.inc(len(buses))
+            publish_buses(publish_channel, buses)
+            if recorder is not None:
+                recorder.record(buses)
+            if metrics.ingest_messages.value % consts.LOG_SAMPLE_RATE == 0:
+                logger.debug('message received: %s', message)
         except ConnectionClosed:
             break
 
 
-async def main() -> None:
-    config = configure_application()
-    registered_buses = {}
-    handle_bus_messages = partial(get_bus_messages, registered_buses=registered_buses)
+async def expire_buses(registered_buses: BusesStorage, expire_timeout: float) -> None:
+    """Periodically remove buses whose emulator stopped sending updates.
+
+    Args:
+        registered_buses: all busses data from clients;
+        expire_timeout: periodic timeout in seconds.
+    """
+    while True:
+        expired_bus_ids = registered_buses.expire()
+        if expired_bus_ids:
+            logger.info(f'{len(expired_bus_ids)} buses expired')
+        metrics.buses_registered.set(len(registered_buses))
+        await trio.sleep(expire_timeout)
+
+
+async def run_server(config: ConfigData, hub_socket_path: str | None = None, metrics_port: int = 0) -> None:
+    """Serve emulators and browsers, sharing buses with other server workers through the hub if it is set."""
+    registered_buses = BusesStorage()
+    publish_send_channel, publish_receive_channel = trio.open_memory_channel(consts.HUB_QUEUE_SIZE)
+    recorder = TrackRecorder(tracks_dir=config.tracks_dir) if config.tracks_dir else None
+    handle_bus_messages = partial(
+        get_bus_messages,
+        registered_buses=registered_buses,
+        publish_channel=publish_send_channel if hub_socket_path else None,
+        recorder=recorder,
+    )
     handle_talk_to_browser = partial(
         talk_to_browser,
         update_timeout=consts.BUSES_UPDATE_TIMEOUT,
         registered_buses=registered_buses,
     )
+    serve = serve_websocket_reuse_port if hub_socket_path else serve_websocket
 
     with suppress(KeyboardInterrupt):
         async with trio.open_nursery() as nursery:
-            nursery.start_soon(serve_websocket, handle_bus_messages, config.server_host, config.server_port, None)
-            nursery.start_soon(serve_websocket, handle_talk_to_browser, config.server_host, config.browser_port, None)
+            nursery.start_soon(expire_buses, registered_buses, consts.EXPIRE_BUSES_TIMEOUT)
+            if recorder is not None:
+                nursery.start_soon(write_tracks, recorder, consts.TRACKS_FLUSH_TIMEOUT)
+            if metrics_port:
+                nursery.start_soon(serve_metrics, metrics, config.server_host, metrics_port)
+            if hub_socket_path:
+                nursery.start_soon(exchange_buses, hub_socket_path, registered_buses, publish_receive_channel)
+            nursery.start_soon(serve, handle_bus_messages, config.server_host, config.server_port, None)
+            nursery.start_soon(serve, handle_talk_to_browser, config.server_host, config.browser_port, None)
+
+
+def run_worker(config: ConfigData, hub_socket_path: str, metrics_port: int) -> None:
+    with suppress(KeyboardInterrupt):
+        trio.run(run_server, config, hub_socket_path, metrics_port)
+
+
+def run_workers(config: ConfigData) -> None:
+    """Start server workers sharing ports with SO_REUSEPORT and forward bus updates between them.
+
+    Every worker serves its own metrics on the metrics port increased by the worker index.
+    """
+    with tempfile.TemporaryDirectory() as hub_directory:
+        hub_socket_path = os.path.join(hub_directory, consts.HUB_SOCKET_FILENAME)
+        processes = start_processes(
+            run_worker,
+            [
+                (config, hub_socket_path, config.metrics_port + worker_index if config.metrics_port else 0)
+                for worker_index in range(config.workers)
+            ],
+        )
+        trio.run(run_hub, hub_socket_path)
+        stop_processes(processes)
+
+
+def main() -> None:
+    config = configure_application()
+    if config.logging:
+        logger.setLevel(config.logging.upper())
+    if config.workers > 1:
+        run_workers(config)
+    else:
+        trio.run(run_server, config, None, config.metrics_port)
 
 
 if __name__ == '__main__':
-    trio.run(main)
+    main()
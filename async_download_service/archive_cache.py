@@ -0,0 +1,222 @@
+import asyncio
+import hashlib
+import logging
+import os
+import time
+from collections import OrderedDict
+
+logger = logging.getLogger()
+
+ARCHIVE_EXTENSION = '.zip'
+TEMPORARY_EXTENSION = '.part'
+
+
+def get_archive_key(archive_name, files, archive_options=None):
+    """Hash archive name, archive build options and names, sizes and modification times of the files to archive."""
+    digest = hashlib.sha1(f'{archive_name}\0{sorted((archive_options or {}).items())}\n'.encode())
+    for _, file_name, file_stat in files:
+        digest.update(f'{file_name}\0{file_stat.st_size}\0{file_stat.st_mtime_ns}\n'.encode())
+    return digest.hexdigest()
+
+
+def get_last_modified_ns(files):
+    return max((file_stat.st_mtime_ns for _, _, file_stat in files), default=0)
+
+
+class BuildQueueFull(Exception):
+    pass
+
+
+class ArchiveBuild:
+    """Archive being written to a temporary file, read by every download that requested it meanwhile."""
+
+    def __init__(self, path):
+        self.path = path
+        self.size = 0
+        self.is_finished = False
+        self.error = None
+        self.task = None
+        self._progress = asyncio.Event()
+
+    @classmethod
+    def from_file(cls, path):
+        """Return finished build of the archive file written before."""
+        build = cls(path)
+        build.size = os.path.getsize(path)
+        build.is_finished = True
+        return build
+
+    def notify(self, written_size):
+        self.size += written_size
+        self._progress.set()
+        self._progress = asyncio.Event()
+
+    def finish(self, error=None):
+        self.error = error
+        self.is_finished = True
+        self._progress.set()
+
+    def read(self, chunk_size, start=0, stop=None):
+        """Open the archive file and return async iterator over its chunks from start to stop bytes
+        as soon as they are written.
+
+        The file is opened right away, so the iterator keeps reading it even if the finished archive
+        is evicted from the cache before the download starts.
+        """
+        return self._read(open(self.path, 'rb'), chunk_size, start, stop)
+
+    async def _read(self, archive_file, chunk_size, start, stop):
+        loop = asyncio.get_running_loop()
+        with archive_file:
+            archive_file.seek(start)
+            position = start
+            while stop is None or position < stop:
+                progress = self._progress
+                available_size = self.size if stop is None else min(self.size, stop)
+                if position < available_size:
+                    chunk = await loop.run_in_executor(
+                        None, archive_file.read, min(chunk_size, available_size - position),
+                    )
+                    position += len(chunk)
+                    yield chunk
+                elif self.error is not None:
+                    raise self.error
+                elif self.is_finished:
+                    return
+                else:
+                    await progress.wait()
+
+
+class ArchiveCache:
+    """Finished archives on disk keyed by archive hash and directory signature, evicted least recently used.
+
+    The first request of a missing archive starts its build, concurrent requests of the same archive read
+    the file being written instead of starting another build. Modification time of a cached archive is the latest
+    modification time of its files, so the archive rebuilt after eviction gets the same ETag and Last-Modified.
+
+    At most max_builds archives are built at once, the rest wait in a queue of max_queued_builds archives.
+    """
+
+    def __init__(self, cache_dir, max_size, generate_archive, max_builds, max_queued_builds):
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+        self.generate_archive = generate_archive
+        self.max_builds = max_builds
+        self.max_queued_builds = max_queued_builds
+        self.entries = OrderedDict()
+        self.size = 0
+        self.builds = {}
+        self.running_builds_count = 0
+        self.rejected_builds_count = 0
+        self._build_slots = asyncio.Semaphore(max_builds)
+        self._idle = asyncio.Event()
+        self._idle.set()
+        os.makedirs(cache_dir, exist_ok=True)
+        self._load_entries()
+
+    def _load_entries(self):
+        archives = []
+        for entry in os.scandir(self.cache_dir):
+            if entry.name.endswith(TEMPORARY_EXTENSION):
+                os.remove(entry.path)
+            elif entry.name.endswith(ARCHIVE_EXTENSION):
+                entry_stat = entry.stat()
+                archives.append((entry_stat.st_atime, entry.name[:-len(ARCHIVE_EXTENSION)], entry_stat.st_size))
+        for _, key, size in sorted(archives):
+            self._add(key, size)
+
+    def get_path(self, key):
+        return os.path.join(self.cache_dir, f'{key}{ARCHIVE_EXTENSION}')
+
+    def lookup(self, key):
+        """Return path of the cached archive or None, marking the archive as recently used."""
+        if key not in self.entries:
+            return None
+        archive_path = self.get_path(key)
+        if not os.path.exists(archive_path):
+            self.size -= self.entries.pop(key)
+            return None
+        self.entries.move_to_end(key)
+        return archive_path
+
+    @property
+    def queued_builds_count(self):
+        return len(self.builds) - self.running_builds_count
+
+    async def wait_idle(self):
+        """Wait until no archive is being built or waiting for a build slot."""
+        await self._idle.wait()
+
+    def get_build(self, key, files, **archive_options):
+        """Return the archive build, starting it with archive options if the archive is not being built yet.
+
+        Raises BuildQueueFull if a new build has to wait and the queue is full.
+        """
+        build = self.builds.get(key)
+        if build is None:
+            if len(self.builds) >= self.max_builds + self.max_queued_builds:
+                self.rejected_builds_count += 1
+                raise BuildQueueFull()
+            build = ArchiveBuild(os.path.join(self.cache_dir, f'{key}{TEMPORARY_EXTENSION}'))
+            open(build.path, 'wb').close()
+            build.task = asyncio.ensure_future(self._build(key, files, build, archive_options))
+            self.builds[key] = build
+            self._idle.clear()
+        return build
+
+    async def _build(self, key, files, build, archive_options):
+        loop = asyncio.get_running_loop()
+        try:
+            async with self._build_slots:
+                self.running_builds_count += 1
+                try:
+                    with open(build.path, 'ab') as archive_file:
+                        async for chunk in self.generate_archive(files, **archive_options):
+                            await loop.run_in_executor(None, archive_file.write, chunk)
+                            build.notify(len(chunk))
+                finally:
+                    self.running_builds_count -= 1
+            if build.size > self.max_size:
+                os.remove(build.path)
+                logger.info(f'Archive {key} of {build.size} bytes is too large for cache')
+            else:
+                archive_path = self.get_path(key)
+                os.utime(build.path, ns=(time.time_ns(), get_last_modified_ns(files)))
+                os.replace(build.path, archive_path)
+                build.path = archive_path
+                self._add(key, build.size)
+                logger.info(f'Archive {key} of {build.size} bytes is cached')
+        except asyncio.CancelledError:
+            self._discard_build(build, RuntimeError('Archive build was cancelled'))
+            raise
+        except Exception as error:
+            logger.exception(f'Archive {key} build failed')
+            self._discard_build(build, error)
+        else:
+            build.finish()
+        finally:
+            self.builds.pop(key, None)
+            if not self.builds:
+                self._idle.set()
+
+    def _discard_build(self, build, error):
+        build.finish(error)
+        if os.path.exists(build.path):
+            os.remove(build.path)
+
+    def _add(self, key, size):
+        self.entries[key] = size
+        self.size += size
+        while self.size > self.max_size and self.entries:
+            evicted_key, evicted_size = self.entries.popitem(last=False)
+            self.size -= evicted_size
+            evicted_path = self.get_path(evicted_key)
+            if os.path.exists(evicted_path):
+                os.remove(evicted_path)
+            logger.info(f'Archive {evicted_key} is evicted from cache')
+
+    async def close(self):
+        tasks = [build.task for build in self.builds.values()]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
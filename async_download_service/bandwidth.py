@@ -0,0 +1,103 @@
+import asyncio
+
+CHUNK_INTERVAL = 0.1
+MIN_CHUNK_SIZE = 4 * 1024
+THROUGHPUT_SMOOTHING = 0.3
+MIN_WRITE_SECONDS = 0.001
+
+
+class TokenBucket:
+    """Bytes allowed to send at rate bytes per second with bursts of one second of traffic.
+
+    Every sender takes its bytes at once and sleeps off the debt, so concurrent senders are served in order
+    of their requests without a timer per waiting sender being rescheduled. Zero rate means no limit.
+    """
+
+    def __init__(self, rate):
+        self.rate = rate
+        self.tokens = rate
+        self.updated_at = None
+
+    async def consume(self, amount):
+        if not self.rate:
+            return
+        now = asyncio.get_running_loop().time()
+        if self.updated_at is not None:
+            self.tokens = min(self.rate, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+        self.tokens -= amount
+        if self.tokens < 0:
+            await asyncio.sleep(-self.tokens / self.rate)
+
+
+class Bandwidth:
+    """Egress of the whole server shared by the running downloads."""
+
+    def __init__(self, rate, client_rate, max_chunk_size):
+        self.bucket = TokenBucket(rate)
+        self.client_rate = client_rate
+        self.max_chunk_size = max_chunk_size
+        self.downloads_count = 0
+
+    @property
+    def is_limited(self):
+        return bool(self.bucket.rate or self.client_rate)
+
+    def open_download(self):
+        return DownloadThrottle(self)
+
+
+class DownloadThrottle:
+    """Bandwidth of one download: its own token bucket and chunk size following the client throughput.
+
+    Chunk size is the amount the client receives in CHUNK_INTERVAL seconds, bounded by the fair share
+    of the global rate and by the client rate, so slow clients do not hold large chunks of the shared bucket
+    and fast clients are not slowed down by many small writes.
+    """
+
+    def __init__(self, bandwidth):
+        self.bandwidth = bandwidth
+        self.bucket = TokenBucket(bandwidth.client_rate)
+        self.throughput = None
+
+    def __enter__(self):
+        self.bandwidth.downloads_count += 1
+        return self
+
+    def __exit__(self, *exc_info):
+        self.bandwidth.downloads_count -= 1
+
+    def get_chunk_size(self):
+        chunk_size = self.bandwidth.max_chunk_size
+        if self.throughput is not None:
+            chunk_size = min(chunk_size, self.throughput * CHUNK_INTERVAL)
+        if self.bandwidth.bucket.rate:
+            fair_rate = self.bandwidth.bucket.rate / max(self.bandwidth.downloads_count, 1)
+            chunk_size = min(chunk_size, fair_rate * CHUNK_INTERVAL)
+        if self.bucket.rate:
+            chunk_size = min(chunk_size, self.bucket.rate * CHUNK_INTERVAL)
+        return max(int(chunk_size), MIN_CHUNK_SIZE)
+
+    async def write(self, response, data):
+        """Write data to the response in chunks allowed by the client and global token buckets."""
+        if not self.bandwidth.is_limited:
+            await response.write(data)
+            return
+        loop = asyncio.get_running_loop()
+        position = 0
+        while position < len(data):
+            chunk = data[position:position + self.get_chunk_size()]
+            position += len(chunk)
+            await self.bucket.consume(len(chunk))
+            await self.bandwidth.bucket.consume(len(chunk))
+            started_at = loop.time()
+            await response.write(chunk)
+            self._update_throughput(len(chunk), loop.time() - started_at)
+
+    def _update_throughput(self, size, elapsed):
+        # Write to a not full transport buffer returns at once, it is counted as taking MIN_WRITE_SECONDS.
+        throughput = size / max(elapsed, MIN_WRITE_SECONDS)
+        if self.throughput is None:
+            self.throughput = throughput
+        else:
+            self.throughput += THROUGHPUT_SMOOTHING * (throughput - self.throughput)
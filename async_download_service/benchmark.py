@@ -0,0 +1,67 @@
+import argparse
+import asyncio
+import logging
+import os
+import time
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+
+from zip_stream import generate_zip, list_files
+
+logger = logging.getLogger()
+logging.basicConfig(level=logging.INFO, format='%(message)s')
+
+BENCHMARK_MODES = {
+    'stored': {'compression': zipfile.ZIP_STORED},
+    'deflated 1': {'compression': zipfile.ZIP_DEFLATED, 'compress_level': 1},
+    'deflated 6': {'compression': zipfile.ZIP_DEFLATED, 'compress_level': 6},
+    'deflated 9': {'compression': zipfile.ZIP_DEFLATED, 'compress_level': 9},
+    'auto 6': {'compression': zipfile.ZIP_DEFLATED, 'compress_level': 6, 'store_compressed': True},
+}
+
+
+async def build_archive(files, executor, archive_options):
+    archive_size = 0
+    async for chunk in generate_zip(files, executor=executor, **archive_options):
+        archive_size += len(chunk)
+    return archive_size
+
+
+async def benchmark_archives(media_dir, repeat, zip_workers):
+    """Build archives of every media dir subdirectory with every compression mode and log size, speed and CPU time.
+
+    CPU time includes the zip threads, it is the cost of a download which is not served from the cache.
+    """
+    archives_files = [
+        list_files(entry.path) for entry in sorted(os.scandir(media_dir), key=lambda entry: entry.name)
+        if entry.is_dir()
+    ]
+    files_size = sum(file_stat.st_size for files in archives_files for _, _, file_stat in files)
+    logger.info(f'{len(archives_files)} archives of {files_size / 1024 / 1024:.1f} MB, {repeat} downloads each')
+    logger.info(f'{"mode":>12} {"size, %":>8} {"MB/s":>8} {"CPU ms/download":>16}')
+    with ThreadPoolExecutor(max_workers=zip_workers) as executor:
+        for mode, archive_options in BENCHMARK_MODES.items():
+            archive_size = 0
+            started_at, cpu_started_at = time.perf_counter(), time.process_time()
+            for _ in range(repeat):
+                for files in archives_files:
+                    archive_size += await build_archive(files, executor, archive_options)
+            elapsed, cpu_elapsed = time.perf_counter() - started_at, time.process_time() - cpu_started_at
+            downloads_count = repeat * len(archives_files)
+            logger.info(
+                f'{mode:>12} {archive_size / repeat / files_size * 100:>8.1f} '
+                f'{files_size * repeat / 1024 / 1024 / elapsed:>8.1f} {cpu_elapsed / downloads_count * 1000:>16.1f}',
+            )
+
+
+def main():
+    parser = argparse.ArgumentParser(description='compare archive compression modes on the media dir')
+    parser.add_argument('--media_dir', default='src_photos', help='set path for photos dir')
+    parser.add_argument('--repeat', type=int, default=10, help='set amount of downloads of every archive')
+    parser.add_argument('--zip_workers', type=int, default=os.cpu_count(), help='set amount of zip threads')
+    args = parser.parse_args()
+    asyncio.run(benchmark_archives(args.media_dir, args.repeat, args.zip_workers))
+
+
+if __name__ == '__main__':
+    main()
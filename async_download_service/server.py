@@ -2,51 +2,173 @@ import argparse
 import asyncio
 import logging
 import os
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import suppress
+from functools import partial
 
 import aiofiles
 from aiohttp import web
 from dotenv import load_dotenv
 
+from archive_cache import ArchiveBuild, ArchiveCache, BuildQueueFull, get_archive_key, get_last_modified_ns
+from bandwidth import Bandwidth
+from warm_up import warm_up_archives
+from zip_stream import generate_zip, get_effective_archive_options, get_zip_size, list_files
+
 load_dotenv()
 logger = logging.getLogger()
 
+ARCHIVE_HEADERS = {
+    'Content-Type': 'application/zip',
+    'Content-Disposition': 'attachment; filename=photos.zip',
+}
+BUILD_RETRY_AFTER = 10
+ZIP_COMPRESSIONS = {
+    'auto': {'compression': zipfile.ZIP_DEFLATED, 'store_compressed': True},
+    'deflated': {'compression': zipfile.ZIP_DEFLATED, 'store_compressed': False},
+    'stored': {'compression': zipfile.ZIP_STORED, 'store_compressed': False},
+}
+ZIP_LEVELS = range(10)
 
-async def archive(request):
-    archive_name = request.match_info['archive_hash']
-    archive_path = os.path.join(request.app['media_dir'], archive_name)
-    if not os.path.exists(archive_path):
-        raise web.HTTPNotFound(text='Archive not found')
-    response = web.StreamResponse(headers={
-        'Content-Type': 'application/zip',
-        'Content-Disposition': 'attachment; filename=photos.zip',
-    })
-    response.enable_chunked_encoding(request.app['chunk_size'])
+
+def matches_if_range(request, etag):
+    """Check If-Range header against the archive ETag.
+
+    A date in If-Range is not accepted: renamed files keep their modification time, so Last-Modified
+    of the archive is not a strong validator.
+    """
+    return request.headers.get('If-Range') in (None, f'"{etag}"')
+
+
+async def set_archive_etag(request, response):
+    """Send the archive ETag instead of the one FileResponse makes of the cached file size and mtime."""
+    if isinstance(response, web.FileResponse) and 'archive_etag' in request:
+        response.etag = request['archive_etag']
+
+
+def get_range(request, etag, archive_size):
+    """Return start and stop bytes of the requested archive part, the whole archive if If-Range does not match."""
+    if not matches_if_range(request, etag):
+        return 0, archive_size
+    try:
+        http_range = request.http_range
+    except ValueError:
+        raise web.HTTPRequestRangeNotSatisfiable(headers={'Content-Range': f'bytes */{archive_size}'})
+    start, stop = http_range.start, http_range.stop
+    if start is None and stop is None:
+        return 0, archive_size
+    if start is not None and start < 0:
+        start, stop = max(archive_size + start, 0), archive_size
+    else:
+        start, stop = start or 0, min(archive_size if stop is None else stop, archive_size)
+    if start >= stop:
+        raise web.HTTPRequestRangeNotSatisfiable(headers={'Content-Range': f'bytes */{archive_size}'})
+    return start, stop
+
+
+async def send_archive(request, response, archive_chunks):
     await response.prepare(request)
-    process = await asyncio.subprocess.create_subprocess_exec(
-        'zip', '-r', '-', '.',
-        cwd=archive_path,
-        stdout=asyncio.subprocess.PIPE,
-        stderr=asyncio.subprocess.PIPE,
-    )
     try:
-        while not process.stdout.at_eof():
-            logger.info('Sending archive chunk ...')
-            await response.write(await process.stdout.read(request.app['chunk_size']))
-            await asyncio.sleep(request.app['response_delay'])
+        with request.app['bandwidth'].open_download() as download_throttle:
+            async for chunk in archive_chunks:
+                logger.info('Sending archive chunk ...')
+                await download_throttle.write(response, chunk)
     except asyncio.CancelledError as error:
         logger.info('Download was interrupted')
-        process.kill()
         raise error
     else:
         logger.info('Download was completed')
-    finally:
-        if process.returncode is None:
-            logger.info('Killing ZIP process')
-            process.kill()
-        await process.communicate()
     return response
 
 
+async def send_sized_archive(request, build, archive_size, etag, last_modified_ns):
+    """Send the archive of known size, a part of it if the request has Range header."""
+    start, stop = get_range(request, etag, archive_size)
+    response = web.StreamResponse(headers=ARCHIVE_HEADERS)
+    response.etag = etag
+    response.last_modified = last_modified_ns / 10 ** 9
+    response.headers['Accept-Ranges'] = 'bytes'
+    if (start, stop) != (0, archive_size):
+        response.set_status(web.HTTPPartialContent.status_code)
+        response.headers['Content-Range'] = f'bytes {start}-{stop - 1}/{archive_size}'
+    response.content_length = stop - start
+    return await send_archive(request, response, build.read(request.app['chunk_size'], start, stop))
+
+
+def get_archive_options(application, compress_level=None):
+    """Return archive build options of the configured compression with compress level from the request or config."""
+    if compress_level is None:
+        compress_level = application['zip_level']
+    elif not compress_level.isdigit() or int(compress_level) not in ZIP_LEVELS:
+        raise web.HTTPBadRequest(text=f'Compression level must be from {ZIP_LEVELS[0]} to {ZIP_LEVELS[-1]}')
+    return {**ZIP_COMPRESSIONS[application['zip_compression']], 'compress_level': int(compress_level)}
+
+
+async def archive(request):
+    archive_name = request.match_info['archive_hash']
+    media_dir = os.path.realpath(request.app['media_dir'])
+    archive_path = os.path.join(media_dir, archive_name)
+    if (
+        os.path.dirname(archive_path) != media_dir
+        or os.path.realpath(archive_path) != archive_path
+        or not os.path.isdir(archive_path)
+    ):
+        raise web.HTTPNotFound(text='Archive not found')
+    archive_options = get_archive_options(request.app, request.query.get('level'))
+
+    files = await asyncio.get_running_loop().run_in_executor(None, list_files, archive_path)
+    archive_options = get_effective_archive_options(files, archive_options)
+    archive_cache = request.app['archive_cache']
+    archive_key = get_archive_key(archive_name, files, archive_options)
+    # The key covers names, sizes and mtimes of the files and build options, so it is a strong ETag of the archive.
+    # Size and mtime are not: they stay the same when a file is renamed.
+    etag = archive_key
+    cached_archive_path = archive_cache.lookup(archive_key)
+    if cached_archive_path is not None:
+        logger.info('Sending cached archive')
+        if not request.app['bandwidth'].is_limited and 'Range' not in request.headers:
+            request['archive_etag'] = etag
+            return web.FileResponse(cached_archive_path, chunk_size=request.app['chunk_size'], headers=ARCHIVE_HEADERS)
+        # sendfile can not be throttled and FileResponse checks If-Range by date only, such downloads read
+        # the cached file like the archive being built.
+        build = ArchiveBuild.from_file(cached_archive_path)
+        return await send_sized_archive(request, build, build.size, etag, get_last_modified_ns(files))
+
+    try:
+        build = archive_cache.get_build(archive_key, files, **archive_options)
+    except BuildQueueFull:
+        logger.warning('Archive build queue is full')
+        raise web.HTTPServiceUnavailable(
+            text='Too many archives are being prepared, try again later',
+            headers={'Retry-After': str(BUILD_RETRY_AFTER)},
+        )
+    archive_size = get_zip_size(files, archive_options['compression'], archive_options['store_compressed'])
+    if archive_size is None:
+        response = web.StreamResponse(headers=ARCHIVE_HEADERS)
+        response.enable_chunked_encoding()
+        return await send_archive(request, response, build.read(request.app['chunk_size']))
+    return await send_sized_archive(request, build, archive_size, etag, get_last_modified_ns(files))
+
+
+async def handle_metrics(request):
+    archive_cache = request.app['archive_cache']
+    metrics = (
+        ('archive_builds_running', 'gauge', 'Archives being built.', archive_cache.running_builds_count),
+        ('archive_builds_queued', 'gauge', 'Archives waiting for a build slot.', archive_cache.queued_builds_count),
+        ('archive_builds_rejected_total', 'counter', 'Requests rejected because of the full build queue.',
+         archive_cache.rejected_builds_count),
+        ('archive_cache_size_bytes', 'gauge', 'Size of cached archives.', archive_cache.size),
+        ('archive_cache_entries', 'gauge', 'Cached archives.', len(archive_cache.entries)),
+        ('downloads_running', 'gauge', 'Archives being sent through the bandwidth limiter.',
+         request.app['bandwidth'].downloads_count),
+    )
+    lines = []
+    for name, metric_type, description, value in metrics:
+        lines.extend((f'# HELP {name} {description}', f'# TYPE {name} {metric_type}', f'{name} {value}'))
+    return web.Response(text='\n'.join(lines) + '\n', content_type='text/plain', charset='utf-8')
+
+
 async def handle_index_page(request):
     async with aiofiles.open('index.html', mode='r', encoding='UTF-8') as index_file:
         index_contents = await index_file.read()
@@ -56,24 +178,93 @@ async def handle_index_page(request):
 def configure_application(application):
     parser = argparse.ArgumentParser()
     parser.add_argument('--enable_logging', default=True, help='enable console logging', action='store_true')
-    parser.add_argument('--response_delay', default=0, help='set delay in seconds between chunks sending')
     parser.add_argument('--media_dir', default='src_photos', help='set path for photos dir')
     parser.add_argument('--chunk_size', default=10000, help='an integer for chunk size')
+    parser.add_argument('--max_bandwidth', default=0, help='set egress limit of all downloads in KB/s, 0 for no limit')
+    parser.add_argument('--client_bandwidth', default=0, help='set limit of every download in KB/s, 0 for no limit')
+    parser.add_argument('--cache_dir', default='archives_cache', help='set path for cached archives dir')
+    parser.add_argument('--cache_max_size', default=1024, help='set cached archives size limit in megabytes')
+    parser.add_argument(
+        '--zip_compression',
+        default='auto',
+        choices=ZIP_COMPRESSIONS.keys(),
+        help='set archive compression, auto stores already compressed files like JPEG and deflates the rest',
+    )
+    parser.add_argument('--zip_level', default=6, help='set deflate level from 0 to 9, overridden by level parameter')
+    parser.add_argument('--zip_workers', default=os.cpu_count(), help='set amount of threads compressing archives')
+    parser.add_argument('--max_builds', default=2, help='set amount of archives built at once')
+    parser.add_argument('--max_queued_builds', default=10, help='set amount of archives waiting to be built')
+    parser.add_argument(
+        '--warm_up_interval',
+        default=60,
+        help='set interval in seconds between media dir scans for changed archives to build, 0 to disable',
+    )
 
     parser_args = parser.parse_args()
-    application['response_delay'] = int(os.getenv('response_delay', parser_args.response_delay))
     application['media_dir'] = os.getenv('media_dir', parser_args.media_dir)
     application['chunk_size'] = int(os.getenv('chunk_size', parser_args.chunk_size))
-    application['enable_logging'] = os.getenv('enable_logging', parser_args.enable_logging).lower() == 'true'
+    application['bandwidth'] = Bandwidth(
+        int(os.getenv('max_bandwidth', parser_args.max_bandwidth)) * 1024,
+        int(os.getenv('client_bandwidth', parser_args.client_bandwidth)) * 1024,
+        application['chunk_size'],
+    )
+    application['cache_dir'] = os.getenv('cache_dir', parser_args.cache_dir)
+    application['cache_max_size'] = int(os.getenv('cache_max_size', parser_args.cache_max_size)) * 1024 * 1024
+    application['zip_compression'] = os.getenv('zip_compression', parser_args.zip_compression)
+    application['zip_level'] = int(os.getenv('zip_level', parser_args.zip_level))
+    application['zip_workers'] = int(os.getenv('zip_workers', parser_args.zip_workers))
+    application['max_builds'] = int(os.getenv('max_builds', parser_args.max_builds))
+    application['max_queued_builds'] = int(os.getenv('max_queued_builds', parser_args.max_queued_builds))
+    application['warm_up_interval'] = float(os.getenv('warm_up_interval', parser_args.warm_up_interval))
+    application['enable_logging'] = str(os.getenv('enable_logging', parser_args.enable_logging)).lower() == 'true'
     if application['enable_logging']:
         logging.basicConfig(level=logging.INFO)
 
 
-if __name__ == '__main__':
-    app = web.Application()
-    configure_application(application=app)
-    app.add_routes([
+async def open_archive_cache(application):
+    zip_executor = ThreadPoolExecutor(max_workers=application['zip_workers'], thread_name_prefix='zip')
+    application['archive_cache'] = ArchiveCache(
+        application['cache_dir'],
+        application['cache_max_size'],
+        partial(generate_zip, executor=zip_executor),
+        application['max_builds'],
+        application['max_queued_builds'],
+    )
+    yield
+    await application['archive_cache'].close()
+    zip_executor.shutdown()
+
+
+async def run_archives_warm_up(application):
+    if not application['warm_up_interval']:
+        yield
+        return
+    warm_up_task = asyncio.ensure_future(warm_up_archives(
+        application['archive_cache'],
+        application['media_dir'],
+        get_archive_options(application),
+        application['warm_up_interval'],
+    ))
+    yield
+    warm_up_task.cancel()
+    with suppress(asyncio.CancelledError):
+        await warm_up_task
+
+
+def create_application():
+    application = web.Application()
+    application.cleanup_ctx.append(open_archive_cache)
+    application.cleanup_ctx.append(run_archives_warm_up)
+    application.on_response_prepare.append(set_archive_etag)
+    application.add_routes([
         web.get('/', handle_index_page),
         web.get('/archive/{archive_hash}/', archive),
+        web.get('/metrics', handle_metrics),
     ])
+    return application
+
+
+if __name__ == '__main__':
+    app = create_application()
+    configure_application(application=app)
     web.run_app(app)
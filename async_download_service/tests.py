@@ -0,0 +1,424 @@
+import asyncio
+import io
+import os
+import zipfile
+from contextlib import asynccontextmanager
+
+import pytest
+from yarl import URL
+
+from archive_cache import ArchiveCache, BuildQueueFull, get_archive_key
+from bandwidth import CHUNK_INTERVAL, Bandwidth, TokenBucket
+from server import create_application, get_archive_options
+from warm_up import warm_up_archives
+from zip_stream import generate_zip, get_effective_archive_options, get_zip_size, list_files
+
+ARCHIVE_URL = '/archive/photos/'
+
+
+async def generate_chunks(files, chunks_count=1, chunk_size=100):
+    for _ in range(chunks_count):
+        yield b'x' * chunk_size
+
+
+@pytest.fixture
+def media_dir(tmp_path):
+    photos_dir = tmp_path / 'media' / 'photos'
+    (photos_dir / 'album').mkdir(parents=True)
+    (photos_dir / '1.jpg').write_bytes(os.urandom(50000))
+    (photos_dir / 'album' / '2.png').write_bytes(os.urandom(20000))
+    (photos_dir / 'readme.txt').write_text('photos of the day\n' * 1000)
+    return tmp_path / 'media'
+
+
+async def build_zip(files, **archive_options):
+    return b''.join([chunk async for chunk in generate_zip(files, **archive_options)])
+
+
+def make_application(tmp_path, media_dir, **settings):
+    application = create_application()
+    application.update({
+        'media_dir': str(media_dir),
+        'chunk_size': 4096,
+        'cache_dir': str(tmp_path / 'cache'),
+        'cache_max_size': 10 * 1024 * 1024,
+        'zip_compression': 'auto',
+        'zip_level': 6,
+        'zip_workers': 2,
+        'max_builds': 2,
+        'max_queued_builds': 10,
+        'warm_up_interval': 0,
+        'bandwidth': Bandwidth(0, 0, 4096),
+    })
+    application.update(settings)
+    return application
+
+
+@pytest.mark.asyncio
+async def test_archive_cache_evicts_least_recently_used(tmp_path):
+    archive_cache = ArchiveCache(str(tmp_path), 250, generate_chunks, 2, 10)
+    for key in ('first', 'second'):
+        await archive_cache.get_build(key, []).task
+    assert archive_cache.lookup('first') is not None
+
+    await archive_cache.get_build('third', []).task
+    assert list(archive_cache.entries) == ['first', 'third']
+    assert archive_cache.size == 200
+    assert not os.path.exists(archive_cache.get_path('second'))
+    assert archive_cache.lookup('second') is None
+
+    await archive_cache.get_build('large', [], chunks_count=3).task
+    assert not os.path.exists(archive_cache.get_path('large'))
+    assert list(archive_cache.entries) == ['first', 'third']
+
+
+@pytest.mark.asyncio
+async def test_archive_cache_removes_unfinished_archives_on_start(tmp_path):
+    (tmp_path / 'finished.zip').write_bytes(b'x' * 100)
+    (tmp_path / 'unfinished.part').write_bytes(b'x' * 50)
+    archive_cache = ArchiveCache(str(tmp_path), 250, generate_chunks, 2, 10)
+    assert list(archive_cache.entries) == ['finished']
+    assert archive_cache.size == 100
+    assert not (tmp_path / 'unfinished.part').exists()
+
+
+def hold_builds(archive_cache):
+    """Make archive builds wait for the returned event and return it with the list of started builds."""
+    generate_archive = archive_cache.generate_archive
+    builds_started = []
+    build_gate = asyncio.Event()
+
+    async def generate_archive_after_gate(files, **archive_options):
+        builds_started.append(files)
+        await build_gate.wait()
+        async for chunk in generate_archive(files, **archive_options):
+            yield chunk
+
+    archive_cache.generate_archive = generate_archive_after_gate
+    return build_gate, builds_started
+
+
+async def wait_for_build(archive_cache):
+    while not archive_cache.builds:
+        await asyncio.sleep(0.01)
+    await asyncio.sleep(0.1)
+
+
+@pytest.mark.asyncio
+async def test_concurrent_downloads_share_one_build(aiohttp_client, tmp_path, media_dir):
+    client = await aiohttp_client(make_application(tmp_path, media_dir))
+    archive_cache = client.app['archive_cache']
+    build_gate, builds_started = hold_builds(archive_cache)
+    downloads = [asyncio.ensure_future(client.get(ARCHIVE_URL)) for _ in range(2)]
+    await wait_for_build(archive_cache)
+    build_gate.set()
+    bodies = [await (await download).read() for download in downloads]
+    assert len(builds_started) == 1
+    assert bodies[0] == bodies[1]
+    assert list(archive_cache.entries)
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize('archive_name', ['%2E%2E', '..%2Fmedia%2Fphotos', 'missing', '1.jpg'])
+async def test_archive_outside_media_dir_is_not_found(aiohttp_client, tmp_path, media_dir, archive_name):
+    os.symlink(media_dir / 'photos' / '1.jpg', media_dir / '1.jpg')
+    client = await aiohttp_client(make_application(tmp_path, media_dir))
+    response = await client.get(URL(f'/archive/{archive_name}/', encoded=True))
+    assert response.status == 404
+    assert not client.app['archive_cache'].builds
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize('archive_options', [
+    {'compression': zipfile.ZIP_STORED},
+    {'compression': zipfile.ZIP_DEFLATED},
+    {'compression': zipfile.ZIP_DEFLATED, 'compress_level': 1, 'store_compressed': True},
+])
+async def test_generate_zip_is_readable_and_deterministic(media_dir, archive_options):
+    files = list_files(str(media_dir / 'photos'))
+    archive = await build_zip(files, **archive_options)
+    assert await build_zip(files, **archive_options) == archive
+
+    with zipfile.ZipFile(io.BytesIO(archive)) as zip_file:
+        assert zip_file.testzip() is None
+        assert zip_file.namelist() == ['1.jpg', 'readme.txt', 'album/2.png']
+        for file_path, archive_name, _ in files:
+            with open(file_path, 'rb') as file:
+                assert zip_file.read(archive_name) == file.read()
+        compressions = {info.filename: info.compress_type for info in zip_file.infolist()}
+
+    if archive_options.get('store_compressed'):
+        assert compressions == {
+            '1.jpg': zipfile.ZIP_STORED,
+            'readme.txt': zipfile.ZIP_DEFLATED,
+            'album/2.png': zipfile.ZIP_STORED,
+        }
+    else:
+        assert set(compressions.values()) == {archive_options['compression']}
+
+
+@pytest.mark.asyncio
+async def test_get_zip_size_matches_stored_archive(media_dir):
+    files = list_files(str(media_dir / 'photos'))
+    assert get_zip_size(files) == len(await build_zip(files, compression=zipfile.ZIP_STORED))
+    assert get_zip_size(files, zipfile.ZIP_DEFLATED) is None
+    assert get_zip_size(files, zipfile.ZIP_DEFLATED, store_compressed=True) is None
+
+    photos = [file for file in files if not file[1].endswith('.txt')]
+    assert get_zip_size(photos, zipfile.ZIP_DEFLATED, store_compressed=True) == len(
+        await build_zip(photos, compression=zipfile.ZIP_DEFLATED, store_compressed=True),
+    )
+
+
+@pytest.mark.asyncio
+async def test_generate_zip_of_empty_directory(tmp_path):
+    files = list_files(str(tmp_path))
+    archive = await build_zip(files)
+    assert files == []
+    assert get_zip_size(files) == len(archive)
+    with zipfile.ZipFile(io.BytesIO(archive)) as zip_file:
+        assert zip_file.testzip() is None
+        assert zip_file.namelist() == []
+
+
+def get_archive_etag(application, files):
+    """Return ETag of the photos archive, which is its key in the archive cache."""
+    return get_archive_key('photos', files, get_effective_archive_options(files, get_archive_options(application)))
+
+
+async def get_archive(client, is_cached, headers):
+    """Request the archive served from the cache or from the build in progress."""
+    archive_cache = client.app['archive_cache']
+    if is_cached:
+        await (await client.get(ARCHIVE_URL)).read()
+        assert archive_cache.entries
+        return await client.get(ARCHIVE_URL, headers=headers)
+    build_gate, _ = hold_builds(archive_cache)
+    download = asyncio.ensure_future(client.get(ARCHIVE_URL, headers=headers))
+    await wait_for_build(archive_cache)
+    assert not archive_cache.entries
+    build_gate.set()
+    return await download
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize('is_cached', [False, True])
+@pytest.mark.parametrize('archive_range, start, stop', [
+    ('bytes=0-9', 0, 10),
+    ('bytes=-10', -10, None),
+    ('bytes=5-', 5, None),
+    ('bytes=1000-', 1000, None),
+])
+async def test_archive_range(aiohttp_client, tmp_path, media_dir, is_cached, archive_range, start, stop):
+    client = await aiohttp_client(make_application(tmp_path, media_dir, zip_compression='stored'))
+    files = list_files(str(media_dir / 'photos'))
+    archive = await build_zip(files, compression=zipfile.ZIP_STORED)
+    etag = get_archive_etag(client.app, files)
+
+    response = await get_archive(client, is_cached, {'Range': archive_range, 'If-Range': f'"{etag}"'})
+    part = archive[start:stop]
+    first_byte = start % len(archive)
+    assert response.status == 206
+    assert response.headers['ETag'] == f'"{etag}"'
+    assert response.headers['Content-Range'] == f'bytes {first_byte}-{first_byte + len(part) - 1}/{len(archive)}'
+    assert await response.read() == part
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize('is_cached', [False, True])
+async def test_archive_range_not_satisfiable(aiohttp_client, tmp_path, media_dir, is_cached):
+    client = await aiohttp_client(make_application(tmp_path, media_dir, zip_compression='stored'))
+    archive_size = get_zip_size(list_files(str(media_dir / 'photos')))
+    response = await get_archive(client, is_cached, {'Range': f'bytes={archive_size}-'})
+    assert response.status == 416
+    assert response.headers['Content-Range'] == f'bytes */{archive_size}'
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize('is_cached', [False, True])
+async def test_archive_range_ignored_for_other_archive(aiohttp_client, tmp_path, media_dir, is_cached):
+    client = await aiohttp_client(make_application(tmp_path, media_dir, zip_compression='stored'))
+    archive = await build_zip(list_files(str(media_dir / 'photos')), compression=zipfile.ZIP_STORED)
+    response = await get_archive(client, is_cached, {'Range': 'bytes=5-', 'If-Range': '"123-abc"'})
+    assert response.status == 200
+    assert await response.read() == archive
+
+
+@pytest.mark.asyncio
+async def test_cached_archive_keeps_etag_of_build(aiohttp_client, tmp_path, media_dir):
+    client = await aiohttp_client(make_application(tmp_path, media_dir, zip_compression='stored'))
+    etag = get_archive_etag(client.app, list_files(str(media_dir / 'photos')))
+    for _ in range(2):
+        response = await client.get(ARCHIVE_URL)
+        await response.read()
+        assert response.headers['ETag'] == f'"{etag}"'
+    assert list(client.app['archive_cache'].entries) == [etag]
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize('validator_header', ['ETag', 'Last-Modified'])
+async def test_archive_range_ignored_after_file_rename(aiohttp_client, tmp_path, media_dir, validator_header):
+    client = await aiohttp_client(make_application(tmp_path, media_dir, zip_compression='stored'))
+    response = await client.get(ARCHIVE_URL)
+    await response.read()
+    os.rename(media_dir / 'photos' / '1.jpg', media_dir / 'photos' / '3.jpg')
+    files = list_files(str(media_dir / 'photos'))
+
+    headers = {'Range': 'bytes=5-', 'If-Range': response.headers[validator_header]}
+    renamed_response = await client.get(ARCHIVE_URL, headers=headers)
+    assert renamed_response.status == 200
+    assert renamed_response.headers['ETag'] not in (response.headers['ETag'], None)
+    assert renamed_response.headers['ETag'] == f'"{get_archive_etag(client.app, files)}"'
+    assert await renamed_response.read() == await build_zip(files, compression=zipfile.ZIP_STORED)
+
+
+@pytest.mark.asyncio
+async def test_full_build_queue_returns_service_unavailable(aiohttp_client, tmp_path, media_dir):
+    (media_dir / 'videos').mkdir()
+    (media_dir / 'videos' / '1.mp4').write_bytes(os.urandom(1000))
+    client = await aiohttp_client(make_application(tmp_path, media_dir, max_builds=1, max_queued_builds=0))
+    archive_cache = client.app['archive_cache']
+    build_gate, _ = hold_builds(archive_cache)
+    download = asyncio.ensure_future(client.get(ARCHIVE_URL))
+    await wait_for_build(archive_cache)
+
+    response = await client.get('/archive/videos/')
+    assert response.status == 503
+    assert response.headers['Retry-After'] == '10'
+    assert archive_cache.rejected_builds_count == 1
+
+    build_gate.set()
+    await (await download).read()
+    assert not archive_cache.builds
+    assert (await client.get('/archive/videos/')).status == 200
+
+
+WARM_UP_INTERVAL = 0.05
+
+
+def get_videos_key(media_dir):
+    return get_archive_key('videos', list_files(str(media_dir / 'videos')), {})
+
+
+async def upload_videos(media_dir, uploads_count):
+    """Add the videos directory and keep changing it for uploads_count half scan intervals."""
+    (media_dir / 'videos').mkdir()
+    for size in range(1, uploads_count + 1):
+        (media_dir / 'videos' / '1.mp4').write_bytes(b'x' * size)
+        await asyncio.sleep(WARM_UP_INTERVAL / 2)
+
+
+@asynccontextmanager
+async def run_warm_up(tmp_path, media_dir):
+    """Run warm-up of media_dir past its first scan, yield its archive cache, build gate and started builds."""
+    archive_cache = ArchiveCache(str(tmp_path / 'cache'), 10 * 1024 * 1024, generate_chunks, 1, 0)
+    build_gate, builds_started = hold_builds(archive_cache)
+    build_gate.set()
+    warm_up_task = asyncio.ensure_future(warm_up_archives(archive_cache, str(media_dir), {}, WARM_UP_INTERVAL))
+    await asyncio.sleep(WARM_UP_INTERVAL * 2)
+    yield archive_cache, build_gate, builds_started
+    warm_up_task.cancel()
+    await archive_cache.close()
+
+
+@pytest.mark.asyncio
+async def test_warm_up_builds_changed_directory_once_it_is_stable(tmp_path, media_dir):
+    async with run_warm_up(tmp_path, media_dir) as (archive_cache, _, builds_started):
+        await upload_videos(media_dir, 8)
+        assert not builds_started
+
+        await asyncio.sleep(WARM_UP_INTERVAL * 4)
+        assert len(builds_started) == 1
+        assert list(archive_cache.entries) == [get_videos_key(media_dir)]
+
+
+@pytest.mark.asyncio
+async def test_warm_up_waits_for_download_builds(tmp_path, media_dir):
+    async with run_warm_up(tmp_path, media_dir) as (archive_cache, build_gate, builds_started):
+        build_gate.clear()
+        download_build = archive_cache.get_build('download', [])
+        await upload_videos(media_dir, 1)
+        await asyncio.sleep(WARM_UP_INTERVAL * 4)
+        assert builds_started == [[]]
+
+        build_gate.set()
+        await download_build.task
+        await asyncio.sleep(WARM_UP_INTERVAL * 2)
+        assert len(builds_started) == 2
+        assert get_videos_key(media_dir) in archive_cache.entries
+
+
+@pytest.mark.asyncio
+async def test_warm_up_retries_directory_rejected_by_full_queue(tmp_path, media_dir):
+    async with run_warm_up(tmp_path, media_dir) as (archive_cache, _, _):
+        get_build = archive_cache.get_build
+        rejected_keys = []
+
+        def reject_first_build(key, files, **archive_options):
+            if not rejected_keys:
+                rejected_keys.append(key)
+                raise BuildQueueFull()
+            return get_build(key, files, **archive_options)
+
+        archive_cache.get_build = reject_first_build
+        await upload_videos(media_dir, 1)
+        await asyncio.sleep(WARM_UP_INTERVAL * 6)
+        assert rejected_keys == [get_videos_key(media_dir)]
+        assert list(archive_cache.entries) == rejected_keys
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize('zip_compression, has_text, archives_count', [
+    ('auto', False, 1),
+    ('auto', True, 2),
+    ('stored', True, 1),
+    ('deflated', False, 2),
+])
+async def test_compress_level_splits_cache_only_for_deflated_files(
+    aiohttp_client, tmp_path, media_dir, zip_compression, has_text, archives_count,
+):
+    if not has_text:
+        (media_dir / 'photos' / 'readme.txt').unlink()
+    client = await aiohttp_client(make_application(tmp_path, media_dir, zip_compression=zip_compression))
+    bodies = [await (await client.get(ARCHIVE_URL, params={'level': level})).read() for level in (1, 9)]
+    assert len(client.app['archive_cache'].entries) == archives_count
+    if archives_count == 1:
+        assert bodies[0] == bodies[1]
+
+
+class ResponseMock:
+    def __init__(self):
+        self.chunks = []
+
+    async def write(self, data):
+        self.chunks.append(data)
+
+
+@pytest.mark.asyncio
+async def test_token_bucket_limits_rate_after_burst():
+    loop = asyncio.get_running_loop()
+    token_bucket = TokenBucket(100000)
+    started_at = loop.time()
+    await token_bucket.consume(100000)
+    assert loop.time() - started_at < 0.05
+    for _ in range(2):
+        await token_bucket.consume(30000)
+    assert 0.55 <= loop.time() - started_at < 0.8
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize('rate, client_rate', [(200000, 50000), (50000, 200000)])
+async def test_download_throttle_applies_client_and_global_rates(rate, client_rate):
+    loop = asyncio.get_running_loop()
+    bandwidth = Bandwidth(rate, client_rate, 64 * 1024)
+    response = ResponseMock()
+    data = os.urandom(60000)
+    started_at = loop.time()
+    with bandwidth.open_download() as download_throttle:
+        assert bandwidth.downloads_count == 1
+        await download_throttle.write(response, data)
+    # Burst of the slower bucket is one second of its rate, the rest is sent at its rate.
+    assert 0.18 <= loop.time() - started_at < 0.4
+    assert bandwidth.downloads_count == 0
+    assert b''.join(response.chunks) == data
+    assert max(len(chunk) for chunk in response.chunks) <= min(rate, client_rate) * CHUNK_INTERVAL
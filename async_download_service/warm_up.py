@@ -0,0 +1,79 @@
+import asyncio
+import logging
+import os
+
+from archive_cache import BuildQueueFull, get_archive_key
+from zip_stream import get_effective_archive_options, list_files
+
+logger = logging.getLogger()
+
+
+def scan_media_dir(media_dir, archive_options):
+    """Return archive keys of all archive directories in the media dir by their names."""
+    keys = {}
+    for entry in os.scandir(media_dir):
+        if not entry.is_dir():
+            continue
+        try:
+            files = list_files(entry.path)
+            keys[entry.name] = get_archive_key(entry.name, files, get_effective_archive_options(files, archive_options))
+        except FileNotFoundError:
+            # Directory or its file was removed while scanning, the next scan sees the result.
+            continue
+    return keys
+
+
+async def warm_up_archives(archive_cache, media_dir, archive_options, scan_interval):
+    """Periodically scan the media dir and build archives of changed directories before they are requested.
+
+    Directories found by the first scan are not built, only those added or changed later. A directory is built
+    once it stays the same for a whole scan interval, so files being uploaded are not archived halfway.
+    Warm-up builds one archive at a time and only while no archive is built for a download, so it does not
+    take build slots and zip threads from live requests. A directory rejected by the full build queue
+    is tried again after the next scan.
+    """
+    loop = asyncio.get_running_loop()
+    archive_keys = None
+    changed_names = set()
+    while True:
+        try:
+            scanned_keys = await loop.run_in_executor(None, scan_media_dir, media_dir, archive_options)
+        except OSError:
+            logger.exception('Media dir scan failed')
+            await asyncio.sleep(scan_interval)
+            continue
+        if archive_keys is not None:
+            for name, key in scanned_keys.items():
+                if key != archive_keys.get(name):
+                    changed_names.add(name)
+                elif name in changed_names:
+                    is_warm = key in archive_cache.entries
+                    if not is_warm:
+                        is_warm = await warm_up_archive(archive_cache, media_dir, name, archive_options)
+                    if is_warm:
+                        changed_names.discard(name)
+        changed_names &= scanned_keys.keys()
+        archive_keys = scanned_keys
+        await asyncio.sleep(scan_interval)
+
+
+async def warm_up_archive(archive_cache, media_dir, archive_name, archive_options):
+    """Build the archive once no other archive is being built, return False if the build queue is full."""
+    loop = asyncio.get_running_loop()
+    await archive_cache.wait_idle()
+    try:
+        files = await loop.run_in_executor(None, list_files, os.path.join(media_dir, archive_name))
+    except FileNotFoundError:
+        return True
+    archive_options = get_effective_archive_options(files, archive_options)
+    archive_key = get_archive_key(archive_name, files, archive_options)
+    if archive_key in archive_cache.entries:
+        return True
+    try:
+        build = archive_cache.get_build(archive_key, files, **archive_options)
+    except BuildQueueFull:
+        logger.warning(f'Archive build queue is full, warm-up of archive {archive_name} is postponed')
+        return False
+    logger.info(f'Warming up archive {archive_name}')
+    await asyncio.shield(build.task)
+    return True
@@ -0,0 +1,225 @@
+import asyncio
+import os
+import struct
+import time
+import zipfile
+import zlib
+
+READ_CHUNK_SIZE = 1024 * 1024
+ZIP64_LIMIT = 0xFFFFFFFF
+ZIP64_ENTRIES_LIMIT = 0xFFFF
+UTF8_NAMES_FLAG = 0x800
+DATA_DESCRIPTOR_FLAG = 0x08
+ZIP_VERSION = 20
+ZIP64_VERSION = 45
+UNIX_SYSTEM = 3
+
+LOCAL_FILE_HEADER = struct.Struct('<4s5H3L2H')
+DATA_DESCRIPTOR = struct.Struct('<4s3L')
+DATA_DESCRIPTOR_ZIP64 = struct.Struct('<4sL2Q')
+CENTRAL_DIRECTORY_HEADER = struct.Struct('<4s6H3L5H2L')
+END_OF_CENTRAL_DIRECTORY = struct.Struct('<4s4H2LH')
+ZIP64_END_OF_CENTRAL_DIRECTORY = struct.Struct('<4sQ2H2L4Q')
+ZIP64_END_OF_CENTRAL_DIRECTORY_LOCATOR = struct.Struct('<4sLQL')
+EXTRA_HEADER = struct.Struct('<2H')
+
+COMPRESSED_EXTENSIONS = frozenset((
+    '.jpg', '.jpeg', '.png', '.gif', '.webp', '.heic', '.avif',
+    '.mp3', '.aac', '.ogg', '.m4a', '.mp4', '.mov', '.avi', '.mkv', '.webm',
+    '.zip', '.gz', '.tgz', '.bz2', '.xz', '.7z', '.rar', '.docx', '.xlsx', '.pptx', '.pdf',
+))
+
+
+class ZipEntry:
+    """File of the archive: its header fields and, after it is written, its CRC and sizes."""
+
+    def __init__(self, path, name, file_stat, compression):
+        self.path = path
+        self.name = name.encode()
+        self.file_size = file_stat.st_size
+        self.external_attr = (file_stat.st_mode & 0xFFFF) << 16
+        self.dos_time, self.dos_date = get_dos_time(file_stat.st_mtime)
+        self.compression = compression
+        self.is_zip64 = self.file_size * 1.05 > ZIP64_LIMIT
+        self.crc = 0
+        self.compressed_size = 0
+        self.offset = 0
+
+    @property
+    def version(self):
+        return ZIP64_VERSION if self.is_zip64 else ZIP_VERSION
+
+    @property
+    def flags(self):
+        return DATA_DESCRIPTOR_FLAG | UTF8_NAMES_FLAG
+
+    def get_local_header(self):
+        extra = b''
+        if self.is_zip64:
+            extra = EXTRA_HEADER.pack(1, 16) + struct.pack('<2Q', 0, 0)
+        return LOCAL_FILE_HEADER.pack(
+            b'PK\x03\x04', self.version, self.flags, self.compression, self.dos_time, self.dos_date,
+            0, ZIP64_LIMIT if self.is_zip64 else 0, ZIP64_LIMIT if self.is_zip64 else 0,
+            len(self.name), len(extra),
+        ) + self.name + extra
+
+    def get_data_descriptor(self):
+        if self.is_zip64:
+            return DATA_DESCRIPTOR_ZIP64.pack(b'PK\x07\x08', self.crc, self.compressed_size, self.file_size)
+        return DATA_DESCRIPTOR.pack(b'PK\x07\x08', self.crc, self.compressed_size, self.file_size)
+
+    def get_central_directory_header(self):
+        zip64_fields = [
+            value for value in (self.file_size, self.compressed_size, self.offset) if value >= ZIP64_LIMIT
+        ]
+        extra = b''
+        if zip64_fields:
+            extra = EXTRA_HEADER.pack(1, 8 * len(zip64_fields)) + struct.pack(f'<{len(zip64_fields)}Q', *zip64_fields)
+        return CENTRAL_DIRECTORY_HEADER.pack(
+            b'PK\x01\x02', UNIX_SYSTEM << 8 | self.version, self.version, self.flags, self.compression,
+            self.dos_time, self.dos_date, self.crc,
+            min(self.compressed_size, ZIP64_LIMIT), min(self.file_size, ZIP64_LIMIT),
+            len(self.name), len(extra), 0, 0, 0, self.external_attr, min(self.offset, ZIP64_LIMIT),
+        ) + self.name + extra
+
+
+def get_dos_time(timestamp):
+    moment = time.localtime(timestamp)
+    if moment.tm_year < 1980:
+        return 0, (1 << 5) | 1
+    dos_time = moment.tm_hour << 11 | moment.tm_min << 5 | moment.tm_sec // 2
+    dos_date = (moment.tm_year - 1980) << 9 | moment.tm_mon << 5 | moment.tm_mday
+    return dos_time, dos_date
+
+
+def get_file_compression(archive_name, compression, store_compressed):
+    """Return compression of the file, files of already compressed types are stored if store_compressed is set."""
+    if store_compressed and os.path.splitext(archive_name)[1].lower() in COMPRESSED_EXTENSIONS:
+        return zipfile.ZIP_STORED
+    return compression
+
+
+def get_effective_archive_options(files, archive_options):
+    """Return archive options without compress level if no file is deflated, the level does not change such archive.
+
+    Archive key includes the options, so the compress level requested for photos does not build the same archive again.
+    """
+    compression = archive_options.get('compression', zipfile.ZIP_DEFLATED)
+    store_compressed = archive_options.get('store_compressed', False)
+    if any(
+        get_file_compression(archive_name, compression, store_compressed) == zipfile.ZIP_DEFLATED
+        for _, archive_name, _ in files
+    ):
+        return archive_options
+    return {name: value for name, value in archive_options.items() if name != 'compress_level'}
+
+
+def list_files(directory_path):
+    """Return paths, archive names and stats of all files in the directory tree in a stable order."""
+    files = []
+    for root, dirs, file_names in os.walk(directory_path):
+        dirs.sort()
+        for file_name in sorted(file_names):
+            file_path = os.path.join(root, file_name)
+            archive_name = os.path.relpath(file_path, directory_path).replace(os.sep, '/')
+            files.append((file_path, archive_name, os.stat(file_path)))
+    return files
+
+
+def get_end_of_central_directory(entries_count, central_directory_size, central_directory_offset):
+    records = b''
+    if (
+        entries_count >= ZIP64_ENTRIES_LIMIT
+        or central_directory_size >= ZIP64_LIMIT
+        or central_directory_offset >= ZIP64_LIMIT
+    ):
+        zip64_offset = central_directory_offset + central_directory_size
+        records += ZIP64_END_OF_CENTRAL_DIRECTORY.pack(
+            b'PK\x06\x06', ZIP64_END_OF_CENTRAL_DIRECTORY.size - 12, UNIX_SYSTEM << 8 | ZIP64_VERSION,
+            ZIP64_VERSION, 0, 0, entries_count, entries_count, central_directory_size, central_directory_offset,
+        )
+        records += ZIP64_END_OF_CENTRAL_DIRECTORY_LOCATOR.pack(b'PK\x06\x07', 0, zip64_offset, 1)
+    return records + END_OF_CENTRAL_DIRECTORY.pack(
+        b'PK\x05\x06', 0, 0, min(entries_count, ZIP64_ENTRIES_LIMIT), min(entries_count, ZIP64_ENTRIES_LIMIT),
+        min(central_directory_size, ZIP64_LIMIT), min(central_directory_offset, ZIP64_LIMIT), 0,
+    )
+
+
+def read_file_chunk(file, crc, compressor):
+    """Read a chunk of the file, update its CRC and compress it. Runs in a worker thread."""
+    data = file.read(READ_CHUNK_SIZE)
+    crc = zlib.crc32(data, crc)
+    if compressor is None:
+        return len(data), crc, data
+    compressed = compressor.compress(data) if data else compressor.flush()
+    return len(data), crc, compressed
+
+
+def get_zip_size(files, compression=zipfile.ZIP_STORED, store_compressed=False):
+    """Return size of the archive of files listed by list_files if all of them are stored, otherwise None.
+
+    Stored file data takes exactly the file size, so the archive size and offsets are known before it is written.
+    """
+    entries = []
+    offset = 0
+    for file_path, archive_name, file_stat in files:
+        if get_file_compression(archive_name, compression, store_compressed) != zipfile.ZIP_STORED:
+            return None
+        entry = ZipEntry(file_path, archive_name, file_stat, zipfile.ZIP_STORED)
+        entry.offset = offset
+        entry.compressed_size = entry.file_size
+        offset += len(entry.get_local_header()) + entry.compressed_size + len(entry.get_data_descriptor())
+        entries.append(entry)
+    central_directory_size = sum(len(entry.get_central_directory_header()) for entry in entries)
+    return offset + central_directory_size + len(
+        get_end_of_central_directory(len(entries), central_directory_size, offset),
+    )
+
+
+async def generate_zip(
+    files, executor=None, compression=zipfile.ZIP_DEFLATED, compress_level=6, store_compressed=False,
+):
+    """Yield ZIP archive of files listed by list_files chunk by chunk.
+
+    Files are read, checksummed and deflated in the executor threads, files of already compressed types
+    like JPEG are stored as is if store_compressed is set. CRC and sizes of every file follow its data
+    in a data descriptor, so the archive is streamed without seeking back; zip64 records are added for files
+    and archives over 4 GiB. The same files give the same archive bytes.
+    """
+    loop = asyncio.get_running_loop()
+    entries = []
+    offset = 0
+    for file_path, archive_name, file_stat in files:
+        entry = ZipEntry(
+            file_path, archive_name, file_stat, get_file_compression(archive_name, compression, store_compressed),
+        )
+        entry.offset = offset
+        local_header = entry.get_local_header()
+        yield local_header
+        offset += len(local_header)
+
+        compressor = None
+        if entry.compression == zipfile.ZIP_DEFLATED:
+            compressor = zlib.compressobj(compress_level, zlib.DEFLATED, -zlib.MAX_WBITS)
+        file_size = 0
+        with await loop.run_in_executor(executor, open, file_path, 'rb') as file:
+            while True:
+                read_size, entry.crc, data = await loop.run_in_executor(
+                    executor, read_file_chunk, file, entry.crc, compressor,
+                )
+                file_size += read_size
+                if data:
+                    entry.compressed_size += len(data)
+                    yield data
+                if not read_size:
+                    break
+        if file_size != entry.file_size:
+            raise RuntimeError(f'File {file_path} was changed while archiving')
+
+        data_descriptor = entry.get_data_descriptor()
+        yield data_descriptor
+        offset += entry.compressed_size + len(data_descriptor)
+        entries.append(entry)
+
+    central_directory = b''.join(entry.get_central_directory_header() for entry in entries)
+    yield central_directory + get_end_of_central_directory(len(entries), len(central_directory), offset)